@@ -0,0 +1,293 @@
+"""Simulated MAX! Home Automation gateway for benchmarks.
+
+Serves get-status-json, get-duty, set-manual, set-automatic, set-boost and
+set-vacation for any number of cubes with generated devices. Latency, failure
+rate and device count are configurable, /stats returns request counters.
+get-changes is the change feed, by long-poll or server-sent events, of shutter
+contacts and eco buttons changing at --event-rate and of commanded thermostats.
+
+    python benchmarks/fake_gateway.py --port 18080 --devices 100 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+# devices per cube of a real installation, more devices go to more cubes
+DEVICES_PER_CUBE = 50
+
+# seconds a long-poll request is held, between keep-alive comments of the stream
+FEED_HOLD = 15
+# changes kept for long-poll clients coming back
+FEED_KEEP = 1000
+
+# share of device types, the rest are radiator thermostats
+SHARE_WALL_THERMOSTATS = 0.15
+SHARE_SHUTTER_CONTACTS = 0.2
+SHARE_ECO_BUTTONS = 0.05
+
+def cube_addresses(device_count):
+    """Return addresses of cubes needed for device_count devices."""
+    cube_count = max(1, (device_count + DEVICES_PER_CUBE - 1) // DEVICES_PER_CUBE)
+    return ["{:06x}".format(0xC00000 + index) for index in range(cube_count)]
+
+def device_type(index):
+    """Return device type of index-th device, types are spread over the cubes."""
+    position = (index * 0.618034) % 1
+    if position < SHARE_ECO_BUTTONS:
+        return 'eco button'
+    if position < SHARE_ECO_BUTTONS + SHARE_SHUTTER_CONTACTS:
+        return 'shutter contact'
+    if position < SHARE_ECO_BUTTONS + SHARE_SHUTTER_CONTACTS + SHARE_WALL_THERMOSTATS:
+        return 'wall thermostat'
+    return 'radiator thermostat'
+
+def make_device(index):
+    """Return status JSON of one generated device."""
+    address = "{:06x}".format(0x100000 + index)
+    device = {
+        'address': address,
+        'name': "Device {}".format(index),
+        'type': device_type(index),
+        'error': False,
+        'initialized': True,
+        'battery_low': False,
+        'link_error': False,
+        }
+    if device['type'] in ('radiator thermostat', 'wall thermostat'):
+        device.update({
+            'temperature': round(random.uniform(18, 23), 1),
+            'set_temperature': 21.0,
+            'mode': 'automatic',
+            'offset': 0.0,
+            'panel_locked': False,
+            })
+    if device['type'] == 'radiator thermostat':
+        device['valve'] = random.randint(0, 100)
+    if device['type'] == 'shutter contact':
+        device['open'] = False
+    if device['type'] == 'eco button':
+        device['mode'] = 'automatic'
+    return device
+
+class FakeGateway:
+    """State and request handlers of the simulated gateway."""
+
+    def __init__(self, device_count, latency = 0, failure_rate = 0, change_rate = 0.1, duty = 10,
+            event_rate = 0):
+        """Initialize the Fake Gateway."""
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.change_rate = change_rate
+        self.duty = duty
+        self.event_rate = event_rate
+        # change feed - cursor of the first kept change, changes, clients waiting for the next one
+        self.feed_base = 0
+        self.feed = []
+        self.feed_waiters = []
+        self.started = time.monotonic()
+        self.counters = {}
+        # cube address -> device address -> device
+        self.cubes = {address: {} for address in cube_addresses(device_count)}
+        cubes = list(self.cubes.values())
+        for index in range(device_count):
+            device = make_device(index)
+            cubes[index // DEVICES_PER_CUBE][device['address']] = device
+
+    def count(self, name, value = 1):
+        """Add value to the counter."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def publish(self, cube, device):
+        """Put the device change to the feed and wake up waiting clients."""
+        self.feed.append({'cube': cube, 'device': dict(device)})
+        if len(self.feed) > FEED_KEEP:
+            self.feed_base += len(self.feed) - FEED_KEEP
+            del self.feed[:-FEED_KEEP]
+        for waiter in self.feed_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.feed_waiters = []
+
+    @property
+    def feed_cursor(self):
+        """Return cursor after the last change."""
+        return self.feed_base + len(self.feed)
+
+    def feed_since(self, cursor):
+        """Return changes after the cursor, those no longer kept are lost."""
+        return self.feed[max(0, cursor - self.feed_base):]
+
+    async def wait_for_change(self, timeout):
+        """Wait for the next change, at most timeout seconds."""
+        waiter = asyncio.get_running_loop().create_future()
+        self.feed_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def generate_events(self, app):
+        """Open and close shutter contacts, press eco buttons at random."""
+        devices = [
+            (cube, device)
+            for cube, cube_devices in self.cubes.items()
+            for device in cube_devices.values()
+            if device['type'] in ('shutter contact', 'eco button')]
+        while devices:
+            await asyncio.sleep(random.expovariate(self.event_rate))
+            cube, device = random.choice(devices)
+            if device['type'] == 'shutter contact':
+                device['open'] = not device['open']
+            else:
+                device['mode'] = 'vacation' if device['mode'] != 'vacation' else 'automatic'
+            self.count('events')
+            self.publish(cube, device)
+
+    async def start_events(self, app):
+        """Start generating events with the application."""
+        if self.event_rate:
+            app['events'] = asyncio.ensure_future(self.generate_events(app))
+
+    async def stop_events(self, app):
+        """Stop generating events."""
+        if 'events' in app:
+            app['events'].cancel()
+
+    async def _simulate(self, request):
+        """Wait for the latency, raise for simulated failure, return the cube devices."""
+        self.count('requests')
+        self.count(request.path)
+        if self.latency:
+            # spread around the mean, as seen on a busy gateway
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            self.count('failures')
+            raise web.HTTPServiceUnavailable()
+        cube = request.query.get('cube', '').lower()
+        if cube not in self.cubes:
+            raise web.HTTPNotFound()
+        return self.cubes[cube]
+
+    def _drift(self, devices):
+        """Change some devices between two status requests."""
+        for device in devices.values():
+            if 'temperature' in device and random.random() < self.change_rate:
+                device['temperature'] = round(device['temperature'] + random.choice((-0.1, 0.1)), 1)
+
+    def _respond(self, body):
+        """Return text response and count its size."""
+        self.count('bytes_sent', len(body))
+        return web.Response(text=body)
+
+    async def get_status_json(self, request):
+        """Return status of all devices of the cube, or of one device."""
+        devices = await self._simulate(request)
+        self._drift(devices)
+        if 'device' in request.query:
+            device = devices.get(request.query['device'].lower())
+            if device is None:
+                raise web.HTTPNotFound()
+            return self._respond(json.dumps(device))
+        return self._respond(json.dumps({
+            'address': request.query['cube'],
+            'devices': list(devices.values()),
+            }))
+
+    async def get_duty(self, request):
+        """Return the cube duty."""
+        await self._simulate(request)
+        return self._respond("{}%".format(self.duty))
+
+    async def set_mode(self, request):
+        """Set mode and temperature of the device."""
+        devices = await self._simulate(request)
+        device = devices.get(request.query.get('device', '').lower())
+        if device is None or 'set_temperature' not in device:
+            raise web.HTTPNotFound()
+        device['mode'] = {
+            '/set-manual': 'manual',
+            '/set-automatic': 'automatic',
+            '/set-boost': 'boost',
+            '/set-vacation': 'vacation',
+            }[request.path]
+        if 'temperature' in request.query:
+            device['set_temperature'] = float(request.query['temperature'])
+        self.publish(request.query['cube'].lower(), device)
+        return self._respond('OK')
+
+    async def get_changes(self, request):
+        """Return changes after the since cursor by long-poll, stream them to event-stream clients."""
+        self.count('requests')
+        self.count(request.path)
+        if request.headers.get('Accept', '') == 'text/event-stream':
+            return await self._stream_changes(request)
+        if 'since' not in request.query:
+            # where the feed is, older changes are in the status
+            return web.json_response({'cursor': self.feed_cursor, 'changes': []})
+        since = int(request.query['since'])
+        if since >= self.feed_cursor:
+            await self.wait_for_change(min(FEED_HOLD, float(request.query.get('timeout', FEED_HOLD))))
+        return web.json_response({'cursor': self.feed_cursor, 'changes': self.feed_since(since)})
+
+    async def _stream_changes(self, request):
+        """Send server-sent event for each batch of changes until the client goes away."""
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        cursor = self.feed_cursor
+        try:
+            while True:
+                await self.wait_for_change(FEED_HOLD)
+                if self.feed_cursor == cursor:
+                    await response.write(b': keep-alive\n\n')
+                    continue
+                message = {'cursor': self.feed_cursor, 'changes': self.feed_since(cursor)}
+                cursor = self.feed_cursor
+                await response.write("data: {}\n\n".format(json.dumps(message)).encode())
+        except ConnectionResetError:
+            # client went away, ie. feed stopped
+            return response
+
+    async def stats(self, request):
+        """Return request counters."""
+        return web.json_response(dict(self.counters,
+            uptime = time.monotonic() - self.started,
+            cubes = {address: list(devices) for address, devices in self.cubes.items()},
+            ))
+
+    def make_app(self):
+        """Return aiohttp application serving the gateway API."""
+        app = web.Application()
+        app.router.add_get('/get-status-json', self.get_status_json)
+        app.router.add_get('/get-duty', self.get_duty)
+        for path in ('/set-manual', '/set-automatic', '/set-boost', '/set-vacation'):
+            app.router.add_get(path, self.set_mode)
+        app.router.add_get('/get-changes', self.get_changes)
+        app.router.add_get('/stats', self.stats)
+        app.on_startup.append(self.start_events)
+        app.on_cleanup.append(self.stop_events)
+        return app
+
+def main():
+    """Run the simulated gateway until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--devices', type=int, default=10, help="number of devices")
+    parser.add_argument('--latency', type=float, default=0, help="mean response latency in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0, help="share of requests failing with 503")
+    parser.add_argument('--change-rate', type=float, default=0.1,
+        help="share of thermostats changing temperature per status request")
+    parser.add_argument('--duty', type=int, default=10, help="reported cube duty in %%")
+    parser.add_argument('--event-rate', type=float, default=0,
+        help="shutter contact and eco button changes per second")
+    args = parser.parse_args()
+    gateway = FakeGateway(args.devices, args.latency, args.failure_rate, args.change_rate, args.duty,
+        args.event_rate)
+    web.run_app(gateway.make_app(), host=args.host, port=args.port, print=None)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""Benchmark of the MAX! Home Automation integration against the simulated gateway.
+
+Starts fake_gateway.py in its own process, sets the integration up in a bare
+Home Assistant core with climate, sensor and binary_sensor platforms, runs
+refresh cycles and reports requests/sec, setup time, CPU and memory.
+With --event-rate the gateway changes shutter contacts and eco buttons, the
+states changed in Home Assistant within --event-seconds are counted, all of
+them come by the change feed of --transport as scheduled polls are far apart.
+Needs Home Assistant installed, nothing is sent to a real gateway.
+
+    python benchmarks/run_benchmark.py --devices 10 100 1000 --cycles 20
+    python benchmarks/run_benchmark.py --devices 100 --event-rate 5 --transport sse
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import aiohttp
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+COMPONENT_DIR = os.path.join(
+    os.path.dirname(BENCHMARKS_DIR), 'custom_components', 'maxhomeautomation')
+
+sys.path.insert(0, BENCHMARKS_DIR)
+from fake_gateway import DEVICES_PER_CUBE, cube_addresses, device_type
+
+# device type reported by the gateway -> configuration list
+MAP_TYPE_CONF = {
+    'radiator thermostat': 'radiator_thermostats',
+    'wall thermostat': 'wall_thermostats',
+    'shutter contact': 'window_shutters',
+    'eco button': 'eco_buttons',
+}
+
+def free_port():
+    """Return a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def make_gateway_config(port, device_count, scan_interval, transport):
+    """Return configuration of one gateway with all devices of the fake gateway."""
+    cubes = []
+    for cube_index, cube_address in enumerate(cube_addresses(device_count)):
+        cube = {
+            'hex_address': cube_address,
+            'name': "Cube {}".format(cube_index),
+            }
+        for conf_key in MAP_TYPE_CONF.values():
+            cube[conf_key] = []
+        cubes.append(cube)
+    for index in range(device_count):
+        # same layout as fake_gateway.FakeGateway
+        cube = cubes[index // DEVICES_PER_CUBE]
+        cube[MAP_TYPE_CONF[device_type(index)]].append({
+            'hex_address': "{:06x}".format(0x100000 + index),
+            'name': "Device {}".format(index),
+            })
+    return {
+        'host': '127.0.0.1',
+        'port': port,
+        'scan_interval': scan_interval,
+        'poll_jitter': 0,
+        'transport': transport,
+        'cubes': cubes,
+        }
+
+async def async_start_hass(config_dir):
+    """Return started bare Home Assistant core loading custom components from config_dir."""
+    from homeassistant import config_entries, loader
+    from homeassistant.core import HomeAssistant
+    from homeassistant.helpers import (
+        area_registry, device_registry, entity, entity_registry, issue_registry, restore_state)
+
+    hass = HomeAssistant(config_dir)
+    hass.config.skip_pip = True
+    loader.async_setup(hass)
+    hass.config_entries = config_entries.ConfigEntries(hass, {})
+    await hass.config_entries.async_initialize()
+    await area_registry.async_load(hass)
+    await device_registry.async_load(hass)
+    await entity_registry.async_load(hass)
+    await issue_registry.async_load(hass)
+    await restore_state.async_load(hass)
+    entity.async_setup(hass)
+    await hass.async_start()
+    # the integration does not need the HTTP server
+    hass.config.components.add('http')
+    return hass
+
+async def async_get_stats(session, port):
+    """Return request counters of the fake gateway."""
+    async with session.get("http://127.0.0.1:{}/stats".format(port)) as response:
+        return await response.json()
+
+async def async_count_requests(session, ports, counter = 'requests'):
+    """Return number of requests served by all fake gateways, or value of other counter."""
+    stats = await asyncio.gather(*(async_get_stats(session, port) for port in ports))
+    return sum(gateway_stats.get(counter, 0) for gateway_stats in stats)
+
+async def async_wait_for_gateway(session, port, timeout = 10):
+    """Wait until the fake gateway answers."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await async_get_stats(session, port)
+        except aiohttp.ClientError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+async def async_check_coalescing(hass, session, port):
+    """Return True if temperature and mode set within the coalesce delay both reach the device."""
+    index = next(index for index in range(DEVICES_PER_CUBE) if device_type(index) == 'radiator thermostat')
+    entity_id = "climate.device_{}".format(index)
+    # queued together, they go out as one command
+    await asyncio.gather(
+        hass.services.async_call('climate', 'set_temperature',
+            {'entity_id': entity_id, 'temperature': 23}, blocking=True),
+        hass.services.async_call('climate', 'set_hvac_mode',
+            {'entity_id': entity_id, 'hvac_mode': 'heat_cool'}, blocking=True))
+    # commands are dispatched after the coalesce delay
+    await asyncio.sleep(1)
+    await hass.async_block_till_done()
+    url = "http://127.0.0.1:{}/get-status-json?cube={}&device={:06x}".format(
+        port, cube_addresses(1)[0], 0x100000 + index)
+    async with session.get(url) as response:
+        device = json.loads(await response.text())
+    return device['mode'] == 'manual' and device['set_temperature'] == 23
+
+async def async_run(device_count, args):
+    """Benchmark one device count, return results."""
+    from homeassistant.setup import async_setup_component
+
+    # devices split evenly over the gateways, the first one takes the rest
+    ports = [free_port() for index in range(args.gateways)]
+    gateway_devices = [device_count // args.gateways] * args.gateways
+    gateway_devices[0] += device_count - sum(gateway_devices)
+    gateways = [
+        subprocess.Popen([sys.executable, os.path.join(BENCHMARKS_DIR, 'fake_gateway.py'),
+            '--port', str(port), '--devices', str(devices),
+            # the first gateway is the slow one
+            '--latency', str(args.latency * (args.slow_factor if index == 0 else 1)),
+            '--failure-rate', str(args.failure_rate), '--event-rate', str(args.event_rate)])
+        for index, (port, devices) in enumerate(zip(ports, gateway_devices))]
+    config = {'maxhomeautomation': {'gateways': [
+        make_gateway_config(port, devices, args.scan_interval, args.transport)
+        for port, devices in zip(ports, gateway_devices)]}}
+    try:
+        async with aiohttp.ClientSession() as session:
+            for port in ports:
+                await async_wait_for_gateway(session, port)
+            with tempfile.TemporaryDirectory() as config_dir:
+                os.makedirs(os.path.join(config_dir, 'custom_components'))
+                os.symlink(COMPONENT_DIR,
+                    os.path.join(config_dir, 'custom_components', 'maxhomeautomation'))
+                hass = await async_start_hass(config_dir)
+
+                tracemalloc.start()
+                memory_before = tracemalloc.get_traced_memory()[0]
+                cpu_before = time.process_time()
+                started = time.monotonic()
+                assert await async_setup_component(hass, 'maxhomeautomation', config)
+                await hass.async_block_till_done()
+                setup_time = time.monotonic() - started
+                entity_count = len(hass.states.async_all())
+
+                # forced refresh cycles of all cubes, as scheduled refreshes do
+                handlers = list(hass.data['maxhomeautomation']['cube_handlers'].values())
+                requests_before = await async_count_requests(session, ports)
+                started = time.monotonic()
+                for cycle in range(args.cycles):
+                    await asyncio.gather(*(handler.async_refresh() for handler in handlers))
+                    await hass.async_block_till_done()
+                cycles_time = time.monotonic() - started
+                requests = await async_count_requests(session, ports) - requests_before
+
+                # changes between polls, only the feed brings them in time
+                events_seen = [0]
+                if args.event_rate:
+                    unsub = hass.bus.async_listen('state_changed',
+                        lambda event: events_seen.__setitem__(0, events_seen[0] + 1))
+                    events_before = await async_count_requests(session, ports, 'events')
+                    await asyncio.sleep(args.event_seconds)
+                    # changes still on the way
+                    await asyncio.sleep(0.5)
+                    await hass.async_block_till_done()
+                    events = await async_count_requests(session, ports, 'events') - events_before
+                    unsub()
+
+                coalescing_ok = await async_check_coalescing(hass, session, ports[0])
+
+                cpu_time = time.process_time() - cpu_before
+                memory = tracemalloc.get_traced_memory()[0] - memory_before
+                tracemalloc.stop()
+                await hass.async_stop()
+    finally:
+        for gateway in gateways:
+            gateway.terminate()
+            gateway.wait()
+
+    return {
+        'devices': device_count,
+        'gateways': args.gateways,
+        'cubes': len(handlers),
+        'entities': entity_count,
+        'setup_s': round(setup_time, 3),
+        'cycle_ms': round(cycles_time / max(1, args.cycles) * 1000, 1),
+        'requests_per_s': round(requests / cycles_time, 1) if cycles_time else None,
+        'coalescing_ok': coalescing_ok,
+        'events': events if args.event_rate else None,
+        'events_seen': events_seen[0] if args.event_rate else None,
+        'cpu_s': round(cpu_time, 3),
+        'memory_kib': round(memory / 1024),
+        # peak of the whole process, it only grows over the runs
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+def main():
+    """Run the benchmark for all device counts, print a table or JSON."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--cycles', type=int, default=10, help="refresh cycles of all cubes")
+    parser.add_argument('--scan-interval', type=int, default=3600,
+        help="scan interval, long by default so scheduled refreshes do not mix in")
+    parser.add_argument('--latency', type=float, default=0, help="mean gateway latency in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0, help="share of failing requests")
+    parser.add_argument('--gateways', type=int, default=1, help="number of fake gateways")
+    parser.add_argument('--slow-factor', type=float, default=1,
+        help="latency multiplier of the first gateway, to check it does not delay the others")
+    parser.add_argument('--transport', default='polling', choices=['polling', 'long_poll', 'sse'],
+        help="transport of the integration, long_poll and sse use the change feed")
+    parser.add_argument('--event-rate', type=float, default=0,
+        help="shutter contact and eco button changes per second of each gateway")
+    parser.add_argument('--event-seconds', type=float, default=10,
+        help="seconds to count states changed by events")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    results = [asyncio.run(async_run(device_count, args)) for device_count in args.devices]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    columns = list(results[0])
+    print(" ".join("{:>14}".format(column) for column in columns))
+    for result in results:
+        print(" ".join("{:>14}".format(str(result[column])) for column in columns))
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,21 @@ maxhomeautomation:
     host: localhost
     port: 8080
     scan_interval: 10
+    duty_soft_limit: 50
+    duty_hard_limit: 80
+    confirm_timeout: 120
+    discovery: false
+    poll_jitter: 0.1
+    adaptive_polling: false
+    max_concurrent_requests: 4
+    history_size: 1440
+    connect_timeout: 5
+    read_timeout: 10
+    latency_budget: 30
+    transport: polling
+    change_feed_path: get-changes
+    scan_intervals:
+      eco_buttons: 300
     cubes:
       - hex_address: 
         name: 
@@ -21,33 +36,66 @@ maxhomeautomation:
         eco_buttons:
           - hex_address:
             name: 
+        zones:
+          - name: 
+            devices:
+              - 
 
 
 """
+import asyncio
 import logging
 import time
-from socket import timeout
-from threading import Lock
 
 import voluptuous as vol
-import requests
 
 import homeassistant.helpers.config_validation as cv
-from homeassistant.helpers.discovery import load_platform
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP, ATTR_TEMPERATURE
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.discovery import async_load_platform
 import json
 
 from .consts import *
+from .commands import MaxHomeAutomationCommandQueue, TEMPERATURE_MODES
+from .discovery import MaxHomeAutomationDiscovery
+from .snapshot import MaxHomeAutomationSnapshot
+from .records import MaxHomeAutomationDeviceRecord, parse_devices
+from .history import MaxHomeAutomationHistory, DEFAULT_HISTORY_SIZE
+from .zones import MaxHomeAutomationZones
+from .transport import FEED_CLASSES, TRANSPORTS, DEFAULT_TRANSPORT, DEFAULT_FEED_PATH
+from .metrics import (
+    MaxHomeAutomationMetrics, METRIC_REFRESHES, METRIC_REFRESH_FAILURES, METRIC_SKIPPED_UPDATES,
+    METRIC_DEFERRED_REFRESHES
+    )
+from .gateway import (
+    MaxHomeAutomationGateway, MaxHomeAutomationGatewayUnavailable, DEFAULT_MAX_REQUESTS,
+    BREAKER_STATE_CLOSED,
+    DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_LATENCY_BUDGET
+    )
+from .scheduler import (
+    MaxHomeAutomationDutyScheduler, DEFAULT_DUTY_SOFT_LIMIT, DEFAULT_DUTY_HARD_LIMIT,
+    MaxHomeAutomationAdaptivePoller, DEFAULT_POLL_JITTER, PRIORITY_NORMAL, ADAPTIVE_FIELDS, stagger_offset,
+    jittered
+    )
 
 _LOGGER = logging.getLogger(__name__)
 
 # DEFAULTS
 DEFAULT_PORT = 8080
-DEFAULT_METHOD = 'GET'
 DEFAULT_SCAN_INTERVAL = 60
+DEFAULT_CONFIRM_TIMEOUT = 120
+DEFAULT_HISTORY_WINDOW = 3600
 
 CONFIG_DEVICE = vol.Schema({
     vol.Required(CONF_HEX_ADDRESS): cv.string,
     vol.Required(CONF_NAME): cv.string,
+    vol.Optional(CONF_SCAN_INTERVAL): cv.time_period,
+})
+
+CONFIG_ZONE = vol.Schema({
+    vol.Required(CONF_NAME): cv.string,
+    vol.Required(CONF_DEVICES): vol.All(cv.ensure_list, [cv.string]),
 })
 
 CONFIG_CUBE = vol.Schema({
@@ -61,17 +109,53 @@ CONFIG_CUBE = vol.Schema({
             vol.All(cv.ensure_list, [CONFIG_DEVICE]),
     vol.Optional(CONF_ECO_BUTTONS, default=[]):
             vol.All(cv.ensure_list, [CONFIG_DEVICE]),
+    vol.Optional(CONF_ZONES, default=[]):
+            vol.All(cv.ensure_list, [CONFIG_ZONE]),
 })
 
 CONFIG_GATEWAY = vol.Schema({
     vol.Required(CONF_HOST): cv.string,
     vol.Optional(CONF_PORT, default = DEFAULT_PORT): cv.port,
     vol.Optional(CONF_SCAN_INTERVAL, default = DEFAULT_SCAN_INTERVAL): cv.time_period,
+    vol.Optional(CONF_DUTY_SOFT_LIMIT, default = DEFAULT_DUTY_SOFT_LIMIT):
+            vol.All(vol.Coerce(float), vol.Range(min=0, max=100)),
+    vol.Optional(CONF_DUTY_HARD_LIMIT, default = DEFAULT_DUTY_HARD_LIMIT):
+            vol.All(vol.Coerce(float), vol.Range(min=0, max=100)),
+    vol.Optional(CONF_CONFIRM_TIMEOUT, default = DEFAULT_CONFIRM_TIMEOUT): cv.time_period,
+    vol.Optional(CONF_DISCOVERY, default = False): cv.boolean,
+    vol.Optional(CONF_POLL_JITTER, default = DEFAULT_POLL_JITTER):
+            vol.All(vol.Coerce(float), vol.Range(min=0, max=0.5)),
+    vol.Optional(CONF_SCAN_INTERVALS, default={}):
+            vol.Schema({vol.In(CONF_DEVICE_TYPES): cv.time_period}),
+    vol.Optional(CONF_ADAPTIVE_POLLING, default = False): cv.boolean,
+    vol.Optional(CONF_MAX_REQUESTS, default = DEFAULT_MAX_REQUESTS):
+            vol.All(vol.Coerce(int), vol.Range(min=1, max=32)),
+    vol.Optional(CONF_HISTORY_SIZE, default = DEFAULT_HISTORY_SIZE):
+            vol.All(vol.Coerce(int), vol.Range(min=0, max=100000)),
+    vol.Optional(CONF_CONNECT_TIMEOUT, default = DEFAULT_CONNECT_TIMEOUT): cv.time_period,
+    vol.Optional(CONF_READ_TIMEOUT, default = DEFAULT_READ_TIMEOUT): cv.time_period,
+    vol.Optional(CONF_LATENCY_BUDGET, default = DEFAULT_LATENCY_BUDGET): cv.time_period,
+    vol.Optional(CONF_TRANSPORT, default = DEFAULT_TRANSPORT): vol.In(TRANSPORTS),
+    vol.Optional(CONF_CHANGE_FEED_PATH, default = DEFAULT_FEED_PATH): cv.string,
     vol.Required(CONF_CUBES, default={}):
             vol.All(cv.ensure_list, [CONFIG_CUBE]),
     
 })
 
+SERVICE_GET_HISTORY_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_WINDOW, default = DEFAULT_HISTORY_WINDOW): cv.time_period,
+    vol.Optional(ATTR_CUBE): cv.string,
+    vol.Optional(ATTR_DEVICE): cv.string,
+})
+
+SERVICE_SET_ZONE_SCHEMA = vol.All(vol.Schema({
+    vol.Optional(ATTR_ZONE): cv.string,
+    vol.Optional(ATTR_DEVICES): vol.All(cv.ensure_list, [cv.string]),
+    vol.Optional(ATTR_HVAC_MODE): vol.In(list(MAP_HASS_HVAC_MODE_MHA)),
+    vol.Optional(ATTR_TEMPERATURE): vol.Coerce(float),
+}), cv.has_at_least_one_key(ATTR_ZONE, ATTR_DEVICES),
+    cv.has_at_least_one_key(ATTR_HVAC_MODE, ATTR_TEMPERATURE))
+
 CONFIG_SCHEMA = vol.Schema({
     DOMAIN: vol.Schema({
         vol.Required(CONF_GATEWAYS, default={}):
@@ -80,118 +164,638 @@ CONFIG_SCHEMA = vol.Schema({
 }, extra=vol.ALLOW_EXTRA)
 
 
-def setup(hass, config):
+async def async_setup(hass, config):
     """Establish connection to MAX!HomeAutomation."""
+    setup_started = time.monotonic()
     if DATA_KEY not in hass.data:
-        hass.data[DATA_KEY] = config
-        
-    # Load platform parts
-    load_platform(hass, 'climate', DOMAIN, {}, config)
-    load_platform(hass, 'sensor', DOMAIN, {}, config)
-    load_platform(hass, 'binary_sensor', DOMAIN, {}, config)
+        hass.data[DATA_KEY] = {
+            DATA_CONFIG: config,
+            # handlers shared by all platforms, see get_device_handler()
+            DATA_DEVICE_HANDLERS: {},
+            DATA_CUBE_HANDLERS: {},
+            DATA_GATEWAYS: {},
+            # gateway base URL -> change feed of gateways with long_poll or sse transport
+            DATA_FEEDS: {},
+            # platform -> (handler, name, sensor type) of its entities
+            DATA_ENTITIES: {platform: [] for platform in PLATFORMS},
+            }
+
+    async def async_close_gateways(event):
+        """Stop refreshing and close pooled connections on Home Assistant shutdown."""
+        for feed in hass.data[DATA_KEY][DATA_FEEDS].values():
+            await feed.async_stop()
+        for handler in hass.data[DATA_KEY][DATA_CUBE_HANDLERS].values():
+            handler.async_stop()
+        for gateway in hass.data[DATA_KEY][DATA_GATEWAYS].values():
+            await gateway.async_close()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_close_gateways)
+
+    # one connection per gateway, each limits its own in-flight requests
+    for gateway in config[DOMAIN][CONF_GATEWAYS]:
+        get_gateway(hass, "http://{}:{}/".format(gateway[CONF_HOST], gateway[CONF_PORT]),
+            max_requests=gateway[CONF_MAX_REQUESTS],
+            connect_timeout=gateway[CONF_CONNECT_TIMEOUT].total_seconds(),
+            read_timeout=gateway[CONF_READ_TIMEOUT].total_seconds(),
+            # one refresh cycle of the gateway
+            latency_budget=gateway[CONF_LATENCY_BUDGET].total_seconds(),
+            budget_window=gateway[CONF_SCAN_INTERVAL].total_seconds())
+
+    # add discovered devices to the configured ones
+    if any(gateway[CONF_DISCOVERY] for gateway in config[DOMAIN][CONF_GATEWAYS]):
+        config = await async_discover_devices(hass, config)
+        hass.data[DATA_KEY][DATA_CONFIG] = config
+
+    # create cube and device handlers up-front with descriptions of entities of all platforms,
+    # entities subscribe to the handlers later
+    entities = hass.data[DATA_KEY][DATA_ENTITIES]
+    history = MaxHomeAutomationHistory()
+    zones = MaxHomeAutomationZones()
+    for gateway in config[DOMAIN][CONF_GATEWAYS]:
+        gateway_url_base = "http://{}:{}/".format(gateway[CONF_HOST], gateway[CONF_PORT])
+        scan_interval = gateway[CONF_SCAN_INTERVAL].total_seconds()
+        duty_scheduler = MaxHomeAutomationDutyScheduler(
+            gateway[CONF_DUTY_SOFT_LIMIT], gateway[CONF_DUTY_HARD_LIMIT])
+        confirm_timeout = gateway[CONF_CONFIRM_TIMEOUT].total_seconds()
+        # spread refreshes of cubes evenly over the scan interval
+        cubes = gateway[CONF_CUBES]
+        for index, cube in enumerate(cubes):
+            handler = get_cube_handler(hass, gateway_url_base, cube[CONF_HEX_ADDRESS], scan_interval,
+                duty_scheduler=duty_scheduler, confirm_timeout=confirm_timeout,
+                poll_offset=stagger_offset(index, len(cubes), scan_interval),
+                poll_jitter=gateway[CONF_POLL_JITTER],
+                adaptive_polling=gateway[CONF_ADAPTIVE_POLLING])
+            history.add_cube(gateway_url_base, cube[CONF_HEX_ADDRESS], handler, gateway[CONF_HISTORY_SIZE])
+            for conf_key in CONF_DEVICE_TYPES:
+                type_interval = gateway[CONF_SCAN_INTERVALS].get(conf_key, None)
+                for device in cube.get(conf_key, []):
+                    # device interval - device own, device type, gateway one
+                    interval = device.get(CONF_SCAN_INTERVAL, None) or type_interval
+                    handler.poller.add_device(device[CONF_HEX_ADDRESS],
+                        interval.total_seconds() if interval is not None else None)
+                    device_handler = get_device_handler(hass, gateway_url_base,
+                        cube[CONF_HEX_ADDRESS], device[CONF_HEX_ADDRESS], scan_interval)
+                    for platform, name, sensor_type in MHA_DEVICE_ENTITIES[conf_key]:
+                        entities[platform].append(
+                            (device_handler, name.format(device[CONF_NAME]), sensor_type))
+                    if conf_key in CONF_THERMOSTAT_TYPES:
+                        zones.add_thermostat(device[CONF_HEX_ADDRESS], device_handler)
+            for zone in cube[CONF_ZONES]:
+                zones.add_zone(zone[CONF_NAME], zone[CONF_DEVICES])
+            for platform, name, sensor_type in MHA_CUBE_ENTITIES:
+                entities[platform].append((handler, name.format(cube[CONF_NAME]), sensor_type))
+        # pushed changes between polls, started after the first refresh
+        feed_class = FEED_CLASSES.get(gateway[CONF_TRANSPORT], None)
+        if feed_class is not None:
+            hass.data[DATA_KEY][DATA_FEEDS][gateway_url_base] = feed_class(hass,
+                get_gateway(hass, gateway_url_base),
+                {cube[CONF_HEX_ADDRESS].lower(): get_cube_handler(
+                    hass, gateway_url_base, cube[CONF_HEX_ADDRESS], scan_interval) for cube in cubes},
+                path=gateway[CONF_CHANGE_FEED_PATH],
+                connect_timeout=gateway[CONF_CONNECT_TIMEOUT].total_seconds(),
+                read_timeout=gateway[CONF_READ_TIMEOUT].total_seconds())
+        gateway_name = "{}:{}".format(gateway[CONF_HOST], gateway[CONF_PORT])
+        for platform, name, sensor_type in MHA_GATEWAY_ENTITIES:
+            entities[platform].append(
+                (get_gateway(hass, gateway_url_base), name.format(gateway_name), sensor_type))
+
+    # seed cube handlers with data from before restart
+    snapshot = MaxHomeAutomationSnapshot(hass, hass.data[DATA_KEY][DATA_CUBE_HANDLERS])
+    await snapshot.async_load()
+    snapshot.start()
+    history.start()
+
+    async def async_dump_metrics(call):
+        """Fire event with metrics of all gateways and cubes, log them as well."""
+        metrics = get_metrics(hass)
+        _LOGGER.info("Max! Home Automation metrics: %s", json.dumps(metrics))
+        hass.bus.async_fire(EVENT_METRICS, metrics)
+
+    hass.services.async_register(DOMAIN, SERVICE_DUMP_METRICS, async_dump_metrics)
+
+    async def async_get_history(call):
+        """Fire event with aggregates of recent history, no recorder query needed."""
+        hass.bus.async_fire(EVENT_HISTORY, history.aggregates(
+            call.data[ATTR_WINDOW].total_seconds(),
+            call.data.get(ATTR_CUBE, None), call.data.get(ATTR_DEVICE, None)))
+
+    hass.services.async_register(DOMAIN, SERVICE_GET_HISTORY, async_get_history,
+        schema=SERVICE_GET_HISTORY_SCHEMA)
+
+    async def async_set_zone(call):
+        """Set thermostats of the zone and the devices at once, fire event with result of each one."""
+        addresses = zones.devices(call.data.get(ATTR_ZONE, None), call.data.get(ATTR_DEVICES, None))
+        results = await zones.async_set(addresses,
+            call.data.get(ATTR_HVAC_MODE, None), call.data.get(ATTR_TEMPERATURE, None))
+        hass.bus.async_fire(EVENT_ZONE_RESULT, {
+            ATTR_ZONE: call.data.get(ATTR_ZONE, None),
+            ATTR_RESULTS: results,
+            })
+
+    hass.services.async_register(DOMAIN, SERVICE_SET_ZONE, async_set_zone,
+        schema=SERVICE_SET_ZONE_SCHEMA)
+
+    # Load platform parts - entities are added with unknown or stale state
+    for platform in PLATFORMS:
+        hass.async_create_task(
+            async_load_platform(hass, platform, DOMAIN, {}, config))
+
+    # first refresh runs in background, it must not delay Home Assistant start
+    hass.async_create_task(async_start_cube_handlers(hass, setup_started))
 
     # platform initialization was successful
     return True
 
+async def async_discover_devices(hass, config):
+    """Return configuration extended by devices of cubes of gateways with discovery enabled."""
+    discovery = MaxHomeAutomationDiscovery(hass)
+    await discovery.async_load()
+
+    async def async_discover_gateway(gateway):
+        """Return gateway configuration extended by discovered devices."""
+        if not gateway[CONF_DISCOVERY]:
+            return gateway
+        gateway_url_base = "http://{}:{}/".format(gateway[CONF_HOST], gateway[CONF_PORT])
+        cubes = await asyncio.gather(*(
+            discovery.async_discover_cube(get_gateway(hass, gateway_url_base), cube)
+            for cube in gateway[CONF_CUBES]))
+        return dict(gateway, **{CONF_CUBES: list(cubes)})
+
+    gateways = await asyncio.gather(*(
+        async_discover_gateway(gateway) for gateway in config[DOMAIN][CONF_GATEWAYS]))
+    await discovery.async_save()
+
+    config = dict(config)
+    config[DOMAIN] = dict(config[DOMAIN], **{CONF_GATEWAYS: list(gateways)})
+    return config
+
+async def async_start_cube_handlers(hass, setup_started):
+    """Run the first refresh of all gateways in parallel and start periodic refresh."""
+    gateways = {}
+    for (gateway_base_url, cube_key), handler in hass.data[DATA_KEY][DATA_CUBE_HANDLERS].items():
+        gateways.setdefault(gateway_base_url, []).append(handler)
+
+    async def async_start_gateway(gateway_base_url, handlers):
+        """Start cubes of one gateway, its request limit keeps the rest waiting."""
+        gateway_started = time.monotonic()
+        await asyncio.gather(*(handler.async_start() for handler in handlers))
+        feed = hass.data[DATA_KEY][DATA_FEEDS].get(gateway_base_url, None)
+        if feed is not None:
+            feed.start()
+        _LOGGER.debug("Initial refresh of %d cube(s) of %s took %.2f s",
+            len(handlers), gateway_base_url, time.monotonic() - gateway_started)
+
+    refresh_started = time.monotonic()
+    # slow gateway does not hold up the others
+    await asyncio.gather(*(
+        async_start_gateway(gateway_base_url, handlers)
+        for gateway_base_url, handlers in gateways.items()))
+    now = time.monotonic()
+    _LOGGER.info("Initial refresh of %d gateway(s) took %.2f s, %.2f s since setup",
+        len(gateways), now - refresh_started, now - setup_started)
+
+def get_metrics(hass):
+    """Return metrics of all gateways with metrics of their cubes."""
+    metrics = {
+        gateway_base_url: dict(gateway.metrics_as_dict(), cubes={})
+        for gateway_base_url, gateway in hass.data[DATA_KEY][DATA_GATEWAYS].items()
+        }
+    for gateway_base_url, feed in hass.data[DATA_KEY][DATA_FEEDS].items():
+        metrics[gateway_base_url]['feed_state'] = feed.state
+    for (gateway_base_url, cube_key), handler in hass.data[DATA_KEY][DATA_CUBE_HANDLERS].items():
+        metrics[gateway_base_url]['cubes'][cube_key] = handler.metrics_as_dict()
+    return metrics
+
+def get_gateway(hass, gateway_base_url, **options):
+    """Return the gateway connection shared by all handlers, create it on first use."""
+    gateways = hass.data[DATA_KEY][DATA_GATEWAYS]
+    gateway = gateways.get(gateway_base_url)
+    if gateway is None:
+        gateway = MaxHomeAutomationGateway(gateway_base_url, **options)
+        gateways[gateway_base_url] = gateway
+    return gateway
+
+def get_device_handler(hass, gateway_base_url, cube_hex_address, device_hex_address, scan_interval):
+    """Return the device handler shared by all platforms, create it on first use."""
+    handlers = hass.data[DATA_KEY][DATA_DEVICE_HANDLERS]
+    key = (gateway_base_url, cube_hex_address.lower(), device_hex_address.lower())
+    handler = handlers.get(key)
+    if handler is None:
+        cube_handler = get_cube_handler(hass, gateway_base_url, cube_hex_address, scan_interval)
+        handler = MaxHomeAutomationDeviceHandler(cube_handler, device_hex_address)
+        handlers[key] = handler
+    return handler
+
+def get_cube_handler(hass, gateway_base_url, cube_hex_address, scan_interval, **options):
+    """Return the cube handler shared by all platforms, create it on first use."""
+    handlers = hass.data[DATA_KEY][DATA_CUBE_HANDLERS]
+    key = (gateway_base_url, cube_hex_address.lower())
+    handler = handlers.get(key)
+    if handler is None:
+        handler = MaxHomeAutomationCubeHandler(
+            hass, get_gateway(hass, gateway_base_url), cube_hex_address, scan_interval, **options)
+        handlers[key] = handler
+    return handler
+
+def fields_changed(previous, current, fields = None):
+    """Return True if any of the fields (all if None) differs between two device data."""
+    if previous is None or current is None:
+        return previous is not current
+    if fields is None:
+        return previous != current
+    return any(previous.get(field, None) != current.get(field, None) for field in fields)
+
 class MaxHomeAutomationDeviceHandler:
-    """Keep the cube instance in one place and centralize the update."""
+    """Serve one device from the cube-wide status snapshot."""
 
-    def __init__(self, gateway_base_url, cube_hex_address,  device_hex_address, scan_interval):
-        """Initialize the Cube Handle."""
+    def __init__(self, cube_handler, device_hex_address):
+        """Initialize the Device Handle."""
         # store initial values
-        self._gateway_base_url = gateway_base_url
-        self._cube_hex_address = cube_hex_address
+        self._cube_handler = cube_handler
+        self._cube_hex_address = cube_handler._cube_hex_address
         self._device_hex_address = device_hex_address
-        self._scan_interval = scan_interval
-        
-        # MAX! Home Automation MAX! Cube JSON API URL
-        device_data_url = self._gateway_base_url + "get-status-json?cube={}&device={}".format(self._cube_hex_address, self._device_hex_address)
-        self._device_data_request = requests.Request(DEFAULT_METHOD, device_data_url).prepare()
-                
-        # JSON data initial value
-        self.data = None
-        
-        # thread synchronization stuff
-        self._mutex = Lock()
-        # initially not actual 
-        self._updatets = time.time() - self._scan_interval;
 
-    def update(self):
-        """Pull the latest data from the MAX! Home Automation."""
-        # Acquire mutex to prevent simultaneous update from multiple threads
-        with self._mutex:
-            # Only update every update_interval
-            if (time.time() - self._updatets) >= self._scan_interval:
-                _LOGGER.debug("Updating")
-
-                self._updatets = time.time()
-
-                # fetch JSON data
-                try:
-                    with requests.Session() as sess:
-                        # call-out
-                        response = sess.send(self._device_data_request, timeout=10)
-                        # process data
-                        json_data = response.text
-                        self.data = json.loads(json_data)
-                        
-                except Exception as ex:
-                    _LOGGER.error("Max! Home Automation connection failed - Cube: {}, Device: {}, JSON data: {}".format (self._cube_hex_address, self._device_hex_address, ex))
-                    self.data = None
-                    # set next try to 60times scan interval
-                    self._updatets = time.time() + (59 * self._scan_interval)
-                    return False
-                
-            else:
-                _LOGGER.debug("Skipping update")
-    
+    @property
+    def gateway(self):
+        """Return the gateway connection."""
+        return self._cube_handler.gateway
+
+    @property
+    def stale(self):
+        """Return True while data are from snapshot taken before restart."""
+        return self._cube_handler.stale
+
+    @property
+    def data(self):
+        """Return JSON data of the device from the last cube update."""
+        return self._cube_handler.get_device_data(self._device_hex_address)
+
+    @callback
+    def async_add_listener(self, update_callback, fields = None):
+        """Register entity callback on change of the device fields, return function to unregister it."""
+        return self._cube_handler.async_add_listener(update_callback, self._device_hex_address, fields)
+
+    async def async_update(self):
+        """Pull the latest data of the whole cube from the MAX! Home Automation."""
+        return await self._cube_handler.async_update()
+
+    async def async_refresh(self):
+        """Pull the latest data of the whole cube immediately."""
+        return await self._cube_handler.async_refresh()
+
+    @callback
+    def async_send_command(self, hass_operation_mode, temperature, priority = PRIORITY_NORMAL):
+        """Queue thermostat command, show its values right away, return future with its result."""
+        future = self._cube_handler.commands.async_enqueue(
+            self._device_hex_address, hass_operation_mode, temperature, priority)
+        if future.done():
+            # unknown mode, nothing queued
+            return future
+
+        values = {MHA_API_MODE: MAP_HASS_HVAC_MODE_MHA[hass_operation_mode]}
+        # only the temperature actually sent, the device would never confirm the other
+        if temperature is not None and hass_operation_mode in TEMPERATURE_MODES:
+            values[MHA_API_SET_TEMPERATURE] = temperature
+        self._cube_handler.async_set_optimistic(self._device_hex_address, values)
+        self._cube_handler.async_poll_soon(self._device_hex_address)
+
+        @callback
+        def command_done(future):
+            """Revert the shown values if the command failed."""
+            if future.cancelled() or not future.result():
+                self._cube_handler.async_clear_optimistic(self._device_hex_address, values)
+
+        future.add_done_callback(command_done)
+        return future
+
 
 class MaxHomeAutomationCubeHandler:
     """Keep the cube instance in one place and centralize the update."""
 
-    def __init__(self, gateway_base_url, cube_hex_address,  scan_interval):
+    def __init__(self, hass, gateway, cube_hex_address,  scan_interval, duty_scheduler=None,
+            confirm_timeout=DEFAULT_CONFIRM_TIMEOUT, poll_offset=0, poll_jitter=0, adaptive_polling=False):
         """Initialize the Cube Handle."""
         # store initial values
-        self._gateway_base_url = gateway_base_url;
+        self._hass = hass
+        self._gateway = gateway
+        self.metrics = MaxHomeAutomationMetrics()
         self._cube_hex_address = cube_hex_address;
         self._scan_interval = scan_interval
+        self.duty_scheduler = duty_scheduler or MaxHomeAutomationDutyScheduler()
+        self._confirm_timeout = confirm_timeout
+        # delay of the first periodic refresh and random spread of all of them
+        self._poll_offset = poll_offset
+        self._poll_jitter = poll_jitter
+        # interval of each device, the cube is refreshed for the most demanding one
+        self.poller = MaxHomeAutomationAdaptivePoller(scan_interval, adaptive_polling)
         
-        # MAX! Home Automation MAX! Cube Duty URL
-        cube_duty_url = self._gateway_base_url + "get-duty?cube={}".format(self._cube_hex_address)
-        self._cube_duty_request = requests.Request(DEFAULT_METHOD, cube_duty_url).prepare()
+        # MAX! Home Automation MAX! Cube JSON API path - all devices of the cube at once
+        self._cube_data_path = "get-status-json?cube={}".format(self._cube_hex_address)
+        # MAX! Home Automation MAX! Cube Duty path
+        self._cube_duty_path = "get-duty?cube={}".format(self._cube_hex_address)
         
-        # JSON data initial value
+        # JSON data of devices indexed by lowercase address, initial value
+        self.devices = None
         self.cube_duty = None
+        # time of the last successful fetch
+        self.updated = None
+        # data are from snapshot taken before restart
+        self.stale = False
         
-        # thread synchronization stuff
-        self._mutex = Lock()
+        # thermostat commands of all devices of the cube
+        self.commands = MaxHomeAutomationCommandQueue(self)
+        # lowercase device address -> (commanded values, confirm deadline)
+        self._optimistic = {}
+
+        # entities to be notified after each refresh
+        self._listeners = []
+        # data and stale flag of the last push, unchanged entities are not written again
+        self._notified = None
+        self._notified_stale = False
+        # cancel callback of the scheduled refresh
+        self._unsub_refresh = None
+        self._stopped = False
+        
+        # single-flight - concurrent updates share the outstanding fetch
+        self._fetch_task = None
+        self._fetch_started = 0
         # initially not actual 
         self._updatets = time.time() - self._scan_interval;
 
-    def update(self):
+    @property
+    def gateway(self):
+        """Return the gateway connection."""
+        return self._gateway
+
+    @property
+    def duty(self):
+        """Return cube duty cycle in percent, None if not known."""
+        if self.cube_duty is None:
+            return None
+        try:
+            return float(self.cube_duty.replace('%', ''))
+        except ValueError:
+            return None
+
+    def get_device_data(self, device_hex_address):
+        """Return JSON data of one device with not yet confirmed command values, None if not available."""
+        if self.devices is None:
+            return None
+        key = device_hex_address.lower()
+        device = self.devices.get(key, None)
+        if device is None or key not in self._optimistic:
+            return device
+        values, expires = self._optimistic[key]
+        return device.replace(values)
+
+    @callback
+    def async_set_optimistic(self, device_hex_address, values):
+        """Show commanded values until the device confirms them or confirm timeout passes."""
+        self._optimistic[device_hex_address.lower()] = (values, time.time() + self._confirm_timeout)
+        self._async_notify_listeners()
+
+    @callback
+    def async_clear_optimistic(self, device_hex_address, values = None):
+        """Drop commanded values, ie. when the command failed - only these values if given,
+        those of a later command stay."""
+        key = device_hex_address.lower()
+        if key not in self._optimistic:
+            return
+        if values is not None and self._optimistic[key][0] is not values:
+            return
+        del self._optimistic[key]
+        self._async_notify_listeners()
+
+    def _reconcile_optimistic(self):
+        """Drop commanded values confirmed by fetched data or timed out."""
+        now = time.time()
+        for key, (values, expires) in list(self._optimistic.items()):
+            device = self.devices.get(key, None) or {}
+            if all(device.get(name, None) == value for name, value in values.items()):
+                _LOGGER.debug("Command confirmed - Cube: %s, Device: %s", self._cube_hex_address, key)
+                del self._optimistic[key]
+            elif now >= expires:
+                _LOGGER.warning("Command not confirmed in time - Cube: %s, Device: %s, expected: %s",
+                    self._cube_hex_address, key, values)
+                del self._optimistic[key]
+
+    @callback
+    def async_add_listener(self, update_callback, device_hex_address = None, fields = None):
+        """Register callback on change of the device fields (all if None), on every refresh without device.
+        Return function to unregister it."""
+        listener = (update_callback,
+            None if device_hex_address is None else device_hex_address.lower(), fields)
+        self._listeners.append(listener)
+
+        @callback
+        def remove_listener():
+            """Unregister callback."""
+            self._listeners.remove(listener)
+
+        return remove_listener
+
+    @callback
+    def async_apply_changes(self, devices):
+        """Take over device records pushed by the change feed between polls."""
+        # nothing to merge into, the next poll brings all devices
+        if self.devices is None:
+            return
+        changed = {
+            key: device for key, device in devices.items()
+            if key in self.devices and self.devices[key] != device
+            }
+        if not changed:
+            return
+        _LOGGER.debug("Pushed change of %d device(s), Cube: %s", len(changed), self._cube_hex_address)
+        # new dictionary - snapshot and history may still hold the polled one
+        self.devices = dict(self.devices, **changed)
+        self._reconcile_optimistic()
+        self._async_notify_listeners()
+
+    def seed(self, devices, cube_duty, updated):
+        """Take over data from snapshot taken before restart."""
+        self.devices = {
+            key: MaxHomeAutomationDeviceRecord(device) for key, device in devices.items()}
+        self.cube_duty = cube_duty
+        self.updated = updated
+        self.stale = True
+        # snapshot younger than scan interval - no need to refresh right away
+        self._updatets = min(updated, time.time())
+
+    async def async_start(self):
+        """Run the first refresh and schedule the periodic one."""
+        if self.devices is None or (time.time() - self._updatets) >= self.poller.interval():
+            await self.async_refresh()
+        else:
+            _LOGGER.debug("Skipping initial update - recent snapshot, Cube: {}".format(self._cube_hex_address))
+        if self._unsub_refresh is None and not self._stopped:
+            self._async_schedule_refresh()
+
+    def metrics_as_dict(self):
+        """Return refresh and command metrics with the current polling state."""
+        return dict(self.metrics.as_dict(),
+            duty = self.duty,
+            poll_interval = self.duty_scheduler.poll_interval(self.poller.interval(), self.duty),
+            pending_commands = self.commands.pending,
+            stale = self.stale,
+            updated = self.updated,
+            )
+
+    @callback
+    def async_poll_soon(self, device_hex_address):
+        """Poll the device fast for a while, ie. after a command."""
+        if self.poller.boost(device_hex_address) and self._unsub_refresh is not None:
+            # reschedule with the shorter interval
+            self._unsub_refresh()
+            self._async_schedule_refresh()
+
+    @callback
+    def async_stop(self):
+        """Cancel the scheduled refresh and pending commands."""
+        self._stopped = True
+        self.commands.async_stop()
+        if self._unsub_refresh is not None:
+            self._unsub_refresh()
+            self._unsub_refresh = None
+        if self._fetch_task is not None:
+            self._fetch_task.cancel()
+
+    @callback
+    def _async_schedule_refresh(self):
+        """Schedule next refresh - one device interval after the last one, stretched by high duty."""
+        interval = self.duty_scheduler.poll_interval(self.poller.interval(), self.duty)
+        interval = jittered(interval, self._poll_jitter) + self._poll_offset
+        # cubes stay apart once they got their offset
+        self._poll_offset = 0
+        delay = max(0, self._updatets + interval - time.time())
+        # gateway is failing - come back once its circuit breaker lets requests through
+        retry_in = self._gateway.retry_in()
+        if retry_in is not None:
+            delay = min(delay, retry_in)
+        self._unsub_refresh = async_call_later(self._hass, delay, self._async_scheduled_refresh)
+
+    async def _async_scheduled_refresh(self, now):
+        """Refresh the cube data and push it to all listeners."""
+        self._unsub_refresh = None
+        # budget of the cycle spent, ie. on a hung gateway - keep the data, try in next cycle
+        deferred = self._gateway.budget.retry_in()
+        if deferred is not None:
+            _LOGGER.debug("Deferring update by %.1f s - latency budget spent, Cube: %s",
+                deferred, self._cube_hex_address)
+            self.metrics.increment(METRIC_DEFERRED_REFRESHES)
+            self._unsub_refresh = async_call_later(self._hass, deferred, self._async_scheduled_refresh)
+            return
+        await self._async_fetch_shared()
+        if not self._stopped:
+            self._async_schedule_refresh()
+
+    @callback
+    def _async_notify_listeners(self):
+        """Push new data to listeners whose fields changed since the last push."""
+        previous = self._notified
+        previous_stale = self._notified_stale
+        # device data as entities see them, with not yet confirmed command values
+        self._notified = None if self.devices is None else {
+            key: self.get_device_data(key) for key in self.devices}
+        self._notified_stale = self.stale
+        # availability or stale flag change is seen by all entities
+        notify_all = (previous is None) != (self._notified is None) or previous_stale != self.stale
+        for update_callback, key, fields in list(self._listeners):
+            if key is None or notify_all:
+                update_callback()
+            elif self._notified is not None and fields_changed(
+                    previous.get(key, None), self._notified.get(key, None), fields):
+                update_callback()
+
+    async def async_update(self):
         """Pull the latest data from the MAX! Home Automation."""
-        # Acquire mutex to prevent simultaneous update from multiple threads
-        with self._mutex:
-            # Only update every update_interval
-            if (time.time() - self._updatets) >= self._scan_interval:
-                _LOGGER.debug("Updating")
+        # Only update every update_interval, fetch in flight counts as update
+        if (time.time() - self._updatets) < self.poller.interval():
+            _LOGGER.debug("Skipping update")
+            self.metrics.increment(METRIC_SKIPPED_UPDATES)
+            return
+        if self._gateway.budget.retry_in() is not None:
+            _LOGGER.debug("Skipping update - latency budget spent, Cube: {}".format(self._cube_hex_address))
+            self.metrics.increment(METRIC_DEFERRED_REFRESHES)
+            return
+        await self._async_fetch_shared()
 
-                self._updatets = time.time()
-                
-                # fetch Duty data
-                try:
-                    with requests.Session() as sess:
-                        # call-out
-                        response = sess.send(self._cube_duty_request, timeout=10)
-                        # process data
-                        self.cube_duty = response.text
-                        
-                except Exception as ex:
-                    _LOGGER.error("Max! Home Automation connection failed - Cube: {}, duty data: {}".format (self._cube_hex_address, ex))
-                    self.cube_duty = None
-                    # set next try to 60times scan interval
-                    self._updatets = time.time() + (59 * self._scan_interval)
-                    return False
+    async def async_refresh(self):
+        """Pull the latest data immediately, ie. after a command, return True on success."""
+        # fetch started before the call may miss the command
+        return await self._async_fetch_shared(time.time())
+
+    async def _async_fetch_shared(self, not_before = 0):
+        """Join fetch in flight started at or after not_before, start a new one otherwise.
+        Return True on success."""
+        while self._fetch_task is not None:
+            task = self._fetch_task
+            if self._fetch_started >= not_before:
+                _LOGGER.debug("Joining update in flight, Cube: {}".format(self._cube_hex_address))
+                return await asyncio.shield(task)
+            # wait for the older one, then go again - somebody else may have started a new one
+            await asyncio.shield(task)
+        self._fetch_started = time.time()
+        self._fetch_task = self._hass.async_create_task(self._async_fetch_and_notify())
+        return await asyncio.shield(self._fetch_task)
+
+    async def _async_fetch_and_notify(self):
+        """Fetch the data once for all waiting callers and push it to listeners."""
+        try:
+            result = await self._async_fetch()
+        finally:
+            self._fetch_task = None
+        self._async_notify_listeners()
+        return result
+
+    async def _async_fetch(self):
+        """Fetch the data, called by the single fetch in flight."""
+        _LOGGER.debug("Updating")
 
+        self._updatets = time.time()
+        self.metrics.increment(METRIC_REFRESHES)
+        started = time.monotonic()
+        
+        # fetch JSON data and Duty data
+        try:
+            if self._gateway.breaker.state == BREAKER_STATE_CLOSED:
+                # call-out - both requests in flight at once, the gateway limits concurrency
+                response, duty_response = await asyncio.gather(
+                    self._gateway.async_get(self._cube_data_path, single_flight=True, raw=True),
+                    self._gateway.async_get(self._cube_duty_path, single_flight=True))
             else:
-                _LOGGER.debug("Skipping update")
+                # status request probes the failing gateway, duty goes once it answered
+                response = await self._gateway.async_get(self._cube_data_path, single_flight=True, raw=True)
+                duty_response = await self._gateway.async_get(self._cube_duty_path, single_flight=True)
+            # process data - device records indexed by address
+            devices = parse_devices(response)
+            previous = self.devices or {}
+            self.poller.refreshed({
+                key for key, device in devices.items()
+                if fields_changed(previous.get(key, None), device, ADAPTIVE_FIELDS)
+                })
+            self.devices = devices
+            self._reconcile_optimistic()
+            # process data
+            self.cube_duty = duty_response
+            self.updated = time.time()
+            self.stale = False
+                
+        except MaxHomeAutomationGatewayUnavailable:
+            # circuit breaker is open, it has already logged the failure
+            _LOGGER.debug("Skipping update - gateway unavailable, Cube: {}".format (self._cube_hex_address))
+            self.metrics.increment(METRIC_REFRESH_FAILURES)
+            self.devices = None
+            self.cube_duty = None
+            return False
+
+        except Exception as ex:
+            _LOGGER.error("Max! Home Automation connection failed - Cube: {}, JSON data: {}".format (self._cube_hex_address, ex))
+            self.metrics.increment(METRIC_REFRESH_FAILURES)
+            self.devices = None
+            self.cube_duty = None
+            return False
+
+        self.metrics.record_latency(time.monotonic() - started)
+
+        return True
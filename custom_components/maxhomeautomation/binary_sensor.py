@@ -2,8 +2,8 @@
 import logging
 
 from homeassistant.components.binary_sensor import BinarySensorEntity
+from homeassistant.core import callback
 from .consts import *
-from .__init__ import MaxHomeAutomationDeviceHandler
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -35,112 +35,17 @@ MHA_VALUE_CAST = {
     MHA_SENSOR_TYPE_SHUTTER_CONTACT: {True: True, False: False, },
 }
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
-    """Iterate through all MAX! Devices."""
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """Add binary sensors described at integration setup."""
+
+    devices = [
+        MaxHomeAutomationBinarySensor (handler, name, sensor_type)
+        for handler, name, sensor_type in hass.data[DATA_KEY][DATA_ENTITIES][PLATFORM_BINARY_SENSOR]
+        ]
 
-    devices = []
-    
-    # read configuration and setup platform
-    gateways = hass.data[DATA_KEY][DOMAIN][CONF_GATEWAYS]
-    for gateway in gateways:
-        host = gateway[CONF_HOST]
-        port = gateway[CONF_PORT]
-        scan_interval = gateway[CONF_SCAN_INTERVAL].total_seconds()
-        cubes = gateway[CONF_CUBES]
-        gateway_url_base= "http://{}:{}/".format(host, port)
-
-        # walk trough cubes
-        for cube in cubes:
-            # read config
-            cube_address = cube[CONF_HEX_ADDRESS]
-            cube_name = cube[CONF_NAME]
-            radiator_thermostats = cube[CONF_RADIATOR_THERMOSTATS]
-            wall_thermostats = cube[CONF_WALL_THERMOSTATS]
-            window_shutters = cube[CONF_WINDOWS_SHUTTERS]
-            eco_buttons = cube[CONF_ECO_BUTTONS]
-        
-            # walk trough radiator thermostats
-            for radiator_thermostat in radiator_thermostats:
-                device_address = radiator_thermostat[CONF_HEX_ADDRESS]
-                device_name = radiator_thermostat[CONF_NAME]
-                
-                handler = MaxHomeAutomationDeviceHandler(
-                    gateway_url_base, cube_address, device_address, scan_interval)
-                
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Error", MHA_SENSOR_TYPE_ERROR))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Initialized", MHA_SENSOR_TYPE_INITIALIZED))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Low battery", MHA_SENSOR_TYPE_BATTERY))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Unlocked", MHA_SENSOR_TYPE_PANEL_LOCKED))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Link", MHA_SENSOR_TYPE_LINK_ERROR))
-
-                            
-            # walk trough wall thermostats
-            for wall_thermostat in wall_thermostats:
-                device_address = wall_thermostat[CONF_HEX_ADDRESS]
-                device_name = wall_thermostat[CONF_NAME]
-                
-                handler = MaxHomeAutomationDeviceHandler(
-                    gateway_url_base, cube_address, device_address, scan_interval)
-                
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Error", MHA_SENSOR_TYPE_ERROR))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Initialized", MHA_SENSOR_TYPE_INITIALIZED))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Low battery", MHA_SENSOR_TYPE_BATTERY))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Unlocked", MHA_SENSOR_TYPE_PANEL_LOCKED))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Link", MHA_SENSOR_TYPE_LINK_ERROR))
-
-                
-            # walk trough window shutters
-            for window_shutter in window_shutters:
-                device_address = window_shutter[CONF_HEX_ADDRESS]
-                device_name = window_shutter[CONF_NAME]
-                
-                handler = MaxHomeAutomationDeviceHandler(
-                    gateway_url_base, cube_address, device_address, scan_interval)
-                
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Error", MHA_SENSOR_TYPE_ERROR))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Initialized", MHA_SENSOR_TYPE_INITIALIZED))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Low battery", MHA_SENSOR_TYPE_BATTERY))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Link", MHA_SENSOR_TYPE_LINK_ERROR))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Open window", MHA_SENSOR_TYPE_SHUTTER_CONTACT))
-                
-                
-            # walk trough eco buttons
-            for eco_button in eco_buttons:
-                device_address = eco_button[CONF_HEX_ADDRESS]
-                device_name = eco_button[CONF_NAME]
-                
-                handler = MaxHomeAutomationDeviceHandler(
-                    gateway_url_base, cube_address, device_address, scan_interval)
-                
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Error", MHA_SENSOR_TYPE_ERROR))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Initialized", MHA_SENSOR_TYPE_INITIALIZED))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Low battery", MHA_SENSOR_TYPE_BATTERY))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Unlocked", MHA_SENSOR_TYPE_PANEL_LOCKED))
-                devices.append(
-                    MaxHomeAutomationBinarySensor (handler, device_name + " - Link", MHA_SENSOR_TYPE_LINK_ERROR))
-               
-    
     if devices:
-        add_entities(devices)
+        # no update before add - cube handlers refresh in background
+        async_add_entities(devices)
 
     # platform initialization was successful
     return True
@@ -157,13 +62,11 @@ class MaxHomeAutomationBinarySensor(BinarySensorEntity):
         self._name = name
         self._sensor_type = sensor_type
         self._read_state = None
-        # read current value
-        self.update()
 
     @property
     def should_poll(self):
-        """Return the polling state."""
-        return True
+        """Return the polling state - cube handler pushes new data."""
+        return False
 
     @property
     def name(self):
@@ -179,6 +82,13 @@ class MaxHomeAutomationBinarySensor(BinarySensorEntity):
     def sensor_type (self):
         return self._sensor_type 
 
+    @property
+    def extra_state_attributes(self):
+        """Return stale flag while data are from before restart."""
+        if self._device_handler.stale:
+            return {ATTR_STALE: True}
+        return None
+
     @property
     def is_on(self):
         """Return true if the binary sensor is on/open."""
@@ -189,9 +99,26 @@ class MaxHomeAutomationBinarySensor(BinarySensorEntity):
         # convert value
         return MHA_VALUE_CAST[self.sensor_type].get(self._read_state, None)
 
-    def update(self):
+    async def async_added_to_hass(self):
+        """Subscribe to cube handler refreshes."""
+        # data may be already there from the initial refresh
+        self._update_state()
+        self.async_on_remove(
+            self._device_handler.async_add_listener(self._async_handle_update, [self.sensor_type]))
+
+    @callback
+    def _async_handle_update(self):
+        """Take over new data pushed by the cube handler."""
+        self._update_state()
+        self.async_write_ha_state()
+
+    async def async_update(self):
         """Get latest data from MAX! Cube."""
-        self._device_handler.update()
+        await self._device_handler.async_update()
+        self._update_state()
+
+    def _update_state(self):
+        """Read the state from data of the device handler."""
         device = self._device_handler.data
         # device not found
         if device is None:
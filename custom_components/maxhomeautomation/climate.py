@@ -2,9 +2,6 @@
 import logging
 from typing import Any, Dict, List, Optional
 
-import requests
-from socket import timeout
-
 from homeassistant.components.climate import ClimateEntity
 from homeassistant.components.climate.const import (
     HVAC_MODE_AUTO, HVAC_MODE_HEAT_COOL, HVAC_MODE_HEAT, HVAC_MODE_OFF,
@@ -12,7 +9,7 @@ from homeassistant.components.climate.const import (
     )
 from homeassistant.const import TEMP_CELSIUS, ATTR_TEMPERATURE
 from .consts import *
-from .__init__ import MaxHomeAutomationDeviceHandler
+from .scheduler import PRIORITY_NORMAL, PRIORITY_URGENT, PRIORITY_LOW
 
 from .consts import VERSION
 
@@ -20,56 +17,24 @@ _LOGGER = logging.getLogger(__name__)
 
 SUPPORT_FLAGS = SUPPORT_TARGET_TEMPERATURE
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
-    """Iterate through all MAX! Devices."""
+# device fields shown by the climate entity, it is written only when any of them changes
+CLIMATE_FIELDS = [
+    MHA_API_TEMPERATURE,
+    MHA_API_SET_TEMPERATURE,
+    MHA_API_MODE,
+    ]
 
-    devices = []
-    
-    # read configuration and setup platform
-    gateways = hass.data[DATA_KEY][DOMAIN][CONF_GATEWAYS]
-    for gateway in gateways:
-        host = gateway[CONF_HOST]
-        port = gateway[CONF_PORT]
-        scan_interval = gateway[CONF_SCAN_INTERVAL].total_seconds()
-        cubes = gateway[CONF_CUBES]
-        gateway_url_base= "http://{}:{}/".format(host, port)
-
-        # walk trough cubes
-        for cube in cubes:
-            # read config
-            cube_address = cube[CONF_HEX_ADDRESS]
-            cube_name = cube[CONF_NAME]
-            radiator_thermostats = cube[CONF_RADIATOR_THERMOSTATS]
-            wall_thermostats = cube[CONF_WALL_THERMOSTATS]
-            window_shutters = cube[CONF_WINDOWS_SHUTTERS]
-            eco_buttons = cube[CONF_ECO_BUTTONS]
-        
-            # walk trough radiator thermostats
-            for radiator_thermostat in radiator_thermostats:
-                device_address = radiator_thermostat[CONF_HEX_ADDRESS]
-                device_name = radiator_thermostat[CONF_NAME]
-                
-                handler = MaxHomeAutomationDeviceHandler(
-                    gateway_url_base, cube_address, device_address, scan_interval)
-                
-                devices.append(
-                    MaxHomeAutomationClimate (handler, device_name))
-               
-                            
-            # walk trough wall thermostats
-            for wall_thermostat in wall_thermostats:
-                device_address = wall_thermostat[CONF_HEX_ADDRESS]
-                device_name = wall_thermostat[CONF_NAME]
-                
-                handler = MaxHomeAutomationDeviceHandler(
-                    gateway_url_base, cube_address, device_address, scan_interval)
-                
-                devices.append(
-                    MaxHomeAutomationClimate (handler, device_name))
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """Add climate entities described at integration setup."""
+
+    devices = [
+        MaxHomeAutomationClimate (handler, name)
+        for handler, name, sensor_type in hass.data[DATA_KEY][DATA_ENTITIES][PLATFORM_CLIMATE]
+        ]
 
-    
     if devices:
-        add_entities(devices)
+        # no update before add - cube handlers refresh in background
+        async_add_entities(devices)
 
     # platform initialization was successful
     return True
@@ -91,14 +56,21 @@ class MaxHomeAutomationClimate(ClimateEntity):
 
     @property
     def should_poll(self):
-        """Return the polling state."""
-        return True
+        """Return the polling state - cube handler pushes new data."""
+        return False
 
     @property
     def name(self):
         """Return the name of the climate device."""
         return self._name
 
+    @property
+    def extra_state_attributes(self):
+        """Return stale flag while data are from before restart."""
+        if self._device_handler.stale:
+            return {ATTR_STALE: True}
+        return None
+
     @property
     def min_temp(self):
         """Return the minimum temperature - 4.5 means off."""
@@ -134,13 +106,15 @@ class MaxHomeAutomationClimate(ClimateEntity):
         # return the converted value
         return device.get(MHA_API_SET_TEMPERATURE, None)
 
-    def set_temperature(self, **kwargs):
+    async def async_set_temperature(self, **kwargs):
         """Set new target temperatures."""
         if kwargs.get(ATTR_TEMPERATURE) is None:
             return False
 
         target_temperature = kwargs.get(ATTR_TEMPERATURE)
-        return self.set_max_home_automation_thermostat (self.hvac_mode, target_temperature)
+        # temperature changes wait while the cube duty is above the soft limit
+        return await self.async_set_max_home_automation_thermostat (
+            self.hvac_mode, target_temperature, PRIORITY_LOW)
     
     @property
     def hvac_mode(self) -> str:
@@ -155,9 +129,10 @@ class MaxHomeAutomationClimate(ClimateEntity):
         return MAP_MHA_HVAC_MODE_HASS.get(device.get(MHA_API_MODE, None), None)
 
     
-    def set_hvac_mode(self, hvac_mode: str) -> None:
+    async def async_set_hvac_mode(self, hvac_mode: str) -> None:
         """Set new target hvac mode."""
-        return self.set_max_home_automation_thermostat (hvac_mode, None)
+        # mode changes, ie. off on open window, get through even at high duty
+        return await self.async_set_max_home_automation_thermostat (hvac_mode, None, PRIORITY_URGENT)
     
     @property
     def hvac_modes(self) -> List[str]:
@@ -166,41 +141,16 @@ class MaxHomeAutomationClimate(ClimateEntity):
         """
         return self._hvac_list
     
-    def update(self):
+    async def async_added_to_hass(self):
+        """Subscribe to cube handler refreshes."""
+        self.async_on_remove(
+            self._device_handler.async_add_listener(self.async_write_ha_state, CLIMATE_FIELDS))
+
+    async def async_update(self):
         """Get latest data from MAX! Home Automation"""
-        self._device_handler.update()
+        await self._device_handler.async_update()
     
-    def set_max_home_automation_thermostat (self, hass_operation_mode, temperature):
-        import urllib.request
-        
-        command_url = self._device_handler._gateway_base_url + {
-            HVAC_MODE_AUTO: "set-automatic?cube={}&device={}{}".format(
-                self._device_handler._cube_hex_address, self._device_handler._device_hex_address, 
-                "" if temperature is None else "&temperature={}".format(temperature)),
-            HVAC_MODE_HEAT_COOL: "set-manual?cube={}&device={}{}".format(
-                self._device_handler._cube_hex_address, self._device_handler._device_hex_address, 
-                "&temperature+=0.0" if temperature is None else "&temperature={}".format(temperature)),
-            HVAC_MODE_HEAT: "set-boost?cube={}&device={}".format(
-                self._device_handler._cube_hex_address, self._device_handler._device_hex_address),
-            # TODO vacation length as platform parameter or input
-            HVAC_MODE_OFF: "set-vacation?cube={}&device={}&eco&days=365".format(
-                self._device_handler._cube_hex_address, self._device_handler._device_hex_address),
-            }[hass_operation_mode]
-        
-        if command_url is None:
-            return False
-        
-        _LOGGER.debug("MAX! Home Automation command to be called: {}".format(command_url))
-        
-        try:
-            urllib.request.urlopen(command_url, timeout=10).read()
-        except requests.exceptions.RequestException as ex:
-            _LOGGER.error("Error performing command: %s from %s failed with %s",
-                self._request, self._request.url, ex)
-            return False
-        except timeout: 
-            _LOGGER.error("Max! Home Automation command failed")
-            return False
-        
-        return True
-
+    async def async_set_max_home_automation_thermostat (self, hass_operation_mode, temperature, priority = PRIORITY_NORMAL):
+        """Queue the command, return future with its result."""
+        # dispatched by the cube command queue, which also reads back the new state
+        return self._device_handler.async_send_command(hass_operation_mode, temperature, priority)
@@ -0,0 +1,171 @@
+"""Queue of MAX! Home Automation thermostat commands."""
+import asyncio
+import logging
+
+import aiohttp
+
+from .consts import *
+from .gateway import MaxHomeAutomationGatewayUnavailable
+from .metrics import (
+    METRIC_COMMANDS, METRIC_COMMAND_FAILURES, METRIC_COMMANDS_COALESCED, METRIC_COMMANDS_DEFERRED
+    )
+from .scheduler import PRIORITY_NORMAL
+
+_LOGGER = logging.getLogger(__name__)
+
+# wait for more commands before dispatching - a slider drag ends up as one command
+COMMAND_COALESCE_DELAY = 0.5
+# pause between two commands sent to the cube
+COMMAND_INTERVAL = 0.2
+# how often to check the duty while commands are deferred
+COMMAND_DUTY_WAIT = 10
+
+# modes whose command carries the temperature, boost and vacation ignore it
+TEMPERATURE_MODES = (HVAC_MODE_AUTO, HVAC_MODE_HEAT_COOL)
+
+def build_command_path(cube_hex_address, device_hex_address, hass_operation_mode, temperature):
+    """Return gateway API path setting mode and temperature, None for unknown mode."""
+    return {
+        HVAC_MODE_AUTO: "set-automatic?cube={}&device={}{}".format(
+            cube_hex_address, device_hex_address,
+            "" if temperature is None else "&temperature={}".format(temperature)),
+        HVAC_MODE_HEAT_COOL: "set-manual?cube={}&device={}{}".format(
+            cube_hex_address, device_hex_address,
+            "&temperature+=0.0" if temperature is None else "&temperature={}".format(temperature)),
+        HVAC_MODE_HEAT: "set-boost?cube={}&device={}".format(
+            cube_hex_address, device_hex_address),
+        # TODO vacation length as platform parameter or input
+        HVAC_MODE_OFF: "set-vacation?cube={}&device={}&eco&days=365".format(
+            cube_hex_address, device_hex_address),
+        }.get(hass_operation_mode, None)
+
+class MaxHomeAutomationCommandQueue:
+    """Coalesce, rate-limit and dispatch commands for devices of one cube."""
+
+    def __init__(self, cube_handler):
+        """Initialize the Command Queue."""
+        self._cube_handler = cube_handler
+        # lowercase device address -> (device address, mode, temperature, priority, futures waiting for it),
+        # the path is built at dispatch from what is left after coalescing
+        self._pending = {}
+        # lowercase addresses of pending commands counted as deferred
+        self._deferred = set()
+        self._worker = None
+
+    @property
+    def pending(self):
+        """Return number of commands waiting for dispatch."""
+        return len(self._pending)
+
+    def async_enqueue(self, device_hex_address, hass_operation_mode, temperature, priority = PRIORITY_NORMAL):
+        """Queue a command, return future resolved to True on success, False on failure."""
+        future = asyncio.get_running_loop().create_future()
+        if build_command_path(
+                self._cube_handler._cube_hex_address, device_hex_address, hass_operation_mode, temperature) is None:
+            future.set_result(False)
+            return future
+
+        key = device_hex_address.lower()
+        futures = [future]
+        if key in self._pending:
+            # the later mode wins, the earlier temperature goes along if the later command has none
+            (superseded_address, superseded_mode, superseded_temperature,
+                superseded_priority, superseded_futures) = self._pending[key]
+            if (temperature is None and superseded_temperature is not None
+                    and hass_operation_mode in TEMPERATURE_MODES):
+                temperature = superseded_temperature
+            _LOGGER.debug("Coalescing command %s %s into %s %s", superseded_mode, superseded_temperature,
+                hass_operation_mode, temperature)
+            self._cube_handler.metrics.increment(METRIC_COMMANDS_COALESCED)
+            if superseded_temperature is not None and temperature is None:
+                # ie. boost after set temperature - the earlier temperature is never sent,
+                # a later temperature, ie. of a slider drag, replaces it as the user wants
+                for superseded_future in superseded_futures:
+                    if not superseded_future.done():
+                        superseded_future.set_result(False)
+            else:
+                futures = superseded_futures + futures
+            priority = min(priority, superseded_priority)
+        self._pending[key] = (device_hex_address, hass_operation_mode, temperature, priority, futures)
+
+        if self._worker is None:
+            self._worker = asyncio.get_running_loop().create_task(self._async_dispatch())
+        return future
+
+    def async_stop(self):
+        """Cancel dispatch of the pending commands."""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for device_hex_address, hass_operation_mode, temperature, priority, futures in self._pending.values():
+            for future in futures:
+                future.cancel()
+        self._pending.clear()
+        self._deferred.clear()
+
+    def _next_allowed(self):
+        """Return key of the most urgent, then oldest, command the duty allows, None if none."""
+        duty = self._cube_handler.duty
+        scheduler = self._cube_handler.duty_scheduler
+        allowed = [
+            (priority, order, key)
+            for order, (key, (device_hex_address, hass_operation_mode, temperature, priority, futures))
+                in enumerate(self._pending.items())
+            if scheduler.command_allowed(priority, duty)
+            ]
+        if not allowed:
+            return None
+        return min(allowed)[2]
+
+    async def _async_wait_for_duty(self):
+        """Defer the commands while the cube duty does not allow any of them, return key of next one."""
+        key = self._next_allowed()
+        # warn once per deferral, the duty may stay high for minutes
+        log = _LOGGER.warning
+        while key is None:
+            log("Cube %s duty %s%% too high, deferring %d command(s)",
+                self._cube_handler._cube_hex_address, self._cube_handler.duty, len(self._pending))
+            log = _LOGGER.debug
+            deferred = set(self._pending) - self._deferred
+            self._cube_handler.metrics.increment(METRIC_COMMANDS_DEFERRED, len(deferred))
+            self._deferred |= deferred
+            await asyncio.sleep(COMMAND_DUTY_WAIT)
+            await self._cube_handler.async_update()
+            key = self._next_allowed()
+        return key
+
+    async def _async_dispatch(self):
+        """Send all pending commands, then read back the new state once."""
+        try:
+            await asyncio.sleep(COMMAND_COALESCE_DELAY)
+            while self._pending:
+                key = await self._async_wait_for_duty()
+                device_hex_address, hass_operation_mode, temperature, priority, futures = self._pending.pop(key)
+                self._deferred.discard(key)
+                command_path = build_command_path(
+                    self._cube_handler._cube_hex_address, device_hex_address, hass_operation_mode, temperature)
+                result = await self._async_send(command_path)
+                for future in futures:
+                    if not future.done():
+                        future.set_result(result)
+                if self._pending:
+                    await asyncio.sleep(COMMAND_INTERVAL)
+        finally:
+            self._worker = None
+
+        # read back the new state of the whole batch, entities are not polled
+        await self._cube_handler.async_refresh()
+
+    async def _async_send(self, command_path):
+        """Send one command to the gateway."""
+        _LOGGER.debug("MAX! Home Automation command to be called: {}".format(command_path))
+        self._cube_handler.metrics.increment(METRIC_COMMANDS)
+        try:
+            # shared keep-alive session of the gateway
+            await self._cube_handler.gateway.async_get(command_path)
+        except (aiohttp.ClientError, asyncio.TimeoutError, MaxHomeAutomationGatewayUnavailable) as ex:
+            _LOGGER.error("Error performing command: %s failed with %s",
+                command_path, ex)
+            self._cube_handler.metrics.increment(METRIC_COMMAND_FAILURES)
+            return False
+        return True
@@ -9,6 +9,12 @@ VERSION='0.0.6'
 # PLATFORM CONSTS
 DOMAIN = 'maxhomeautomation'
 DATA_KEY = 'maxhomeautomation'
+DATA_CONFIG = 'config'
+DATA_DEVICE_HANDLERS = 'device_handlers'
+DATA_CUBE_HANDLERS = 'cube_handlers'
+DATA_GATEWAYS = 'gateways'
+DATA_ENTITIES = 'entities'
+DATA_FEEDS = 'feeds'
 
 #SCHEMA
 CONF_GATEWAYS = 'gateways'
@@ -19,6 +25,32 @@ CONF_RADIATOR_THERMOSTATS = 'radiator_thermostats'
 CONF_WALL_THERMOSTATS = 'wall_thermostats'
 CONF_WINDOWS_SHUTTERS = 'window_shutters'
 CONF_ECO_BUTTONS = 'eco_buttons'
+CONF_DUTY_SOFT_LIMIT = 'duty_soft_limit'
+CONF_DUTY_HARD_LIMIT = 'duty_hard_limit'
+CONF_CONFIRM_TIMEOUT = 'confirm_timeout'
+CONF_DISCOVERY = 'discovery'
+CONF_POLL_JITTER = 'poll_jitter'
+CONF_SCAN_INTERVALS = 'scan_intervals'
+CONF_ADAPTIVE_POLLING = 'adaptive_polling'
+CONF_MAX_REQUESTS = 'max_concurrent_requests'
+CONF_HISTORY_SIZE = 'history_size'
+CONF_CONNECT_TIMEOUT = 'connect_timeout'
+CONF_READ_TIMEOUT = 'read_timeout'
+CONF_LATENCY_BUDGET = 'latency_budget'
+CONF_TRANSPORT = 'transport'
+CONF_CHANGE_FEED_PATH = 'change_feed_path'
+CONF_ZONES = 'zones'
+CONF_DEVICES = 'devices'
+CONF_THERMOSTAT_TYPES = [
+    CONF_RADIATOR_THERMOSTATS,
+    CONF_WALL_THERMOSTATS,
+    ]
+CONF_DEVICE_TYPES = [
+    CONF_RADIATOR_THERMOSTATS,
+    CONF_WALL_THERMOSTATS,
+    CONF_WINDOWS_SHUTTERS,
+    CONF_ECO_BUTTONS,
+    ]
 
 #API_CONSTS
 MHA_API_DEVICES = 'devices'
@@ -53,6 +85,9 @@ MAP_MHA_HVAC_MODE_HASS = {
     MHA_STATE_BOOST: HVAC_MODE_HEAT,
     MHA_STATE_VACATION: HVAC_MODE_OFF,
     }
+MAP_HASS_HVAC_MODE_MHA = {
+    hass_mode: mha_mode for mha_mode, hass_mode in MAP_MHA_HVAC_MODE_HASS.items()
+    }
 MAP_MHA_OPERATION_MODE_HASS = {
     MHA_STATE_AUTOMATIC: HVAC_MODE_AUTO,
     MHA_STATE_MANUAL: HVAC_MODE_HEAT_COOL,
@@ -60,6 +95,28 @@ MAP_MHA_OPERATION_MODE_HASS = {
     MHA_STATE_VACATION: HVAC_MODE_OFF,
 }
 
+# state attributes
+ATTR_STALE = 'stale'
+
+# metrics dump
+SERVICE_DUMP_METRICS = 'dump_metrics'
+EVENT_METRICS = DOMAIN + '_metrics'
+
+# history aggregates
+SERVICE_GET_HISTORY = 'get_history'
+EVENT_HISTORY = DOMAIN + '_history'
+ATTR_CUBE = 'cube'
+ATTR_DEVICE = 'device'
+ATTR_WINDOW = 'window'
+
+# zone bulk commands
+SERVICE_SET_ZONE = 'set_zone'
+EVENT_ZONE_RESULT = DOMAIN + '_zone_result'
+ATTR_ZONE = 'zone'
+ATTR_DEVICES = 'devices'
+ATTR_HVAC_MODE = 'hvac_mode'
+ATTR_RESULTS = 'results'
+
 # sensor type constants
 MHA_SENSOR_TYPE_TEMPERATURE = MHA_API_TEMPERATURE
 MHA_SENSOR_TYPE_SET_TEMPERATURE = MHA_API_SET_TEMPERATURE
@@ -67,6 +124,7 @@ MHA_SENSOR_TYPE_VALVE = MHA_API_VALVE
 MHA_SENSOR_TYPE_OFFSET = MHA_API_OFFSET
 MHA_SENSOR_TYPE_ECO_BUTTON = MHA_API_MODE
 MHA_SENSOR_TYPE_DUTY = 'duty'
+MHA_SENSOR_TYPE_LATENCY = 'latency'
 # binary sensor type constants
 MHA_SENSOR_TYPE_ERROR = MHA_API_ERROR
 MHA_SENSOR_TYPE_INITIALIZED = MHA_API_INITIALIZED
@@ -74,3 +132,61 @@ MHA_SENSOR_TYPE_BATTERY = MHA_API_BATTERY
 MHA_SENSOR_TYPE_PANEL_LOCKED = MHA_API_PANEL_LOCKED
 MHA_SENSOR_TYPE_LINK_ERROR = MHA_API_LINK_ERROR
 MHA_SENSOR_TYPE_SHUTTER_CONTACT = MHA_API_OPEN
+
+# platforms
+PLATFORM_CLIMATE = 'climate'
+PLATFORM_SENSOR = 'sensor'
+PLATFORM_BINARY_SENSOR = 'binary_sensor'
+PLATFORMS = [PLATFORM_CLIMATE, PLATFORM_SENSOR, PLATFORM_BINARY_SENSOR]
+
+# entities of each device type - platform, name format, sensor type (None for climate)
+# new device type is one more entry here
+MHA_DEVICE_ENTITIES = {
+    CONF_RADIATOR_THERMOSTATS: [
+        (PLATFORM_CLIMATE, "{}", None),
+        (PLATFORM_SENSOR, "{} - Temperature", MHA_SENSOR_TYPE_TEMPERATURE),
+        (PLATFORM_SENSOR, "{} - Target Temperature", MHA_SENSOR_TYPE_SET_TEMPERATURE),
+        (PLATFORM_SENSOR, "{} - Valve", MHA_SENSOR_TYPE_VALVE),
+        (PLATFORM_SENSOR, "{} - Offset", MHA_SENSOR_TYPE_OFFSET),
+        (PLATFORM_BINARY_SENSOR, "{} - Error", MHA_SENSOR_TYPE_ERROR),
+        (PLATFORM_BINARY_SENSOR, "{} - Initialized", MHA_SENSOR_TYPE_INITIALIZED),
+        (PLATFORM_BINARY_SENSOR, "{} - Low battery", MHA_SENSOR_TYPE_BATTERY),
+        (PLATFORM_BINARY_SENSOR, "{} - Unlocked", MHA_SENSOR_TYPE_PANEL_LOCKED),
+        (PLATFORM_BINARY_SENSOR, "{} - Link", MHA_SENSOR_TYPE_LINK_ERROR),
+        ],
+    CONF_WALL_THERMOSTATS: [
+        (PLATFORM_CLIMATE, "{}", None),
+        (PLATFORM_SENSOR, "{} - Temperature", MHA_SENSOR_TYPE_TEMPERATURE),
+        (PLATFORM_SENSOR, "{} - Target Temperature", MHA_SENSOR_TYPE_SET_TEMPERATURE),
+        (PLATFORM_SENSOR, "{} - Offset", MHA_SENSOR_TYPE_OFFSET),
+        (PLATFORM_BINARY_SENSOR, "{} - Error", MHA_SENSOR_TYPE_ERROR),
+        (PLATFORM_BINARY_SENSOR, "{} - Initialized", MHA_SENSOR_TYPE_INITIALIZED),
+        (PLATFORM_BINARY_SENSOR, "{} - Low battery", MHA_SENSOR_TYPE_BATTERY),
+        (PLATFORM_BINARY_SENSOR, "{} - Unlocked", MHA_SENSOR_TYPE_PANEL_LOCKED),
+        (PLATFORM_BINARY_SENSOR, "{} - Link", MHA_SENSOR_TYPE_LINK_ERROR),
+        ],
+    CONF_WINDOWS_SHUTTERS: [
+        (PLATFORM_BINARY_SENSOR, "{} - Error", MHA_SENSOR_TYPE_ERROR),
+        (PLATFORM_BINARY_SENSOR, "{} - Initialized", MHA_SENSOR_TYPE_INITIALIZED),
+        (PLATFORM_BINARY_SENSOR, "{} - Low battery", MHA_SENSOR_TYPE_BATTERY),
+        (PLATFORM_BINARY_SENSOR, "{} - Link", MHA_SENSOR_TYPE_LINK_ERROR),
+        (PLATFORM_BINARY_SENSOR, "{} - Open window", MHA_SENSOR_TYPE_SHUTTER_CONTACT),
+        ],
+    CONF_ECO_BUTTONS: [
+        (PLATFORM_SENSOR, "{} - Mode", MHA_SENSOR_TYPE_ECO_BUTTON),
+        (PLATFORM_BINARY_SENSOR, "{} - Error", MHA_SENSOR_TYPE_ERROR),
+        (PLATFORM_BINARY_SENSOR, "{} - Initialized", MHA_SENSOR_TYPE_INITIALIZED),
+        (PLATFORM_BINARY_SENSOR, "{} - Low battery", MHA_SENSOR_TYPE_BATTERY),
+        (PLATFORM_BINARY_SENSOR, "{} - Unlocked", MHA_SENSOR_TYPE_PANEL_LOCKED),
+        (PLATFORM_BINARY_SENSOR, "{} - Link", MHA_SENSOR_TYPE_LINK_ERROR),
+        ],
+}
+# entities of each cube, named by the cube
+MHA_CUBE_ENTITIES = [
+    (PLATFORM_SENSOR, "{} - Duty", MHA_SENSOR_TYPE_DUTY),
+    (PLATFORM_SENSOR, "{} - Refresh Latency", MHA_SENSOR_TYPE_LATENCY),
+    ]
+# entities of each gateway, named by host and port
+MHA_GATEWAY_ENTITIES = [
+    (PLATFORM_SENSOR, "MAX! Gateway {} - Request Latency", MHA_SENSOR_TYPE_LATENCY),
+    ]
@@ -0,0 +1,87 @@
+"""Discovery of MAX! devices connected to a cube."""
+import logging
+
+from homeassistant.helpers.storage import Store
+
+from .consts import *
+from .records import json_loads
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+STORAGE_KEY = DOMAIN + '.discovery'
+
+# map device type reported by the gateway to the configuration list
+MAP_MHA_TYPE_CONF = {
+    MHA_API_RADIATOR_THERMOSTAT: CONF_RADIATOR_THERMOSTATS,
+    MHA_API_WALL_THERMOSTAT: CONF_WALL_THERMOSTATS,
+    MHA_API_SHUTTER_CONTACT: CONF_WINDOWS_SHUTTERS,
+    MHA_API_ECO_BUTTON: CONF_ECO_BUTTONS,
+}
+
+def parse_cube_devices(json_data):
+    """Return configuration lists of devices found in cube JSON data."""
+    inventory = {conf_key: [] for conf_key in MAP_MHA_TYPE_CONF.values()}
+    for device in json_data.get(MHA_API_DEVICES, []):
+        address = device.get(MHA_API_ADDRESS, None)
+        conf_key = MAP_MHA_TYPE_CONF.get(device.get(MHA_API_TYPE, None), None)
+        if address is None or conf_key is None:
+            _LOGGER.debug("Skipping unsupported device: %s", device)
+            continue
+        inventory[conf_key].append({
+            CONF_HEX_ADDRESS: address,
+            CONF_NAME: device.get(MHA_API_NAME, None) or address,
+            })
+    return inventory
+
+def merge_cube_devices(cube, inventory):
+    """Return cube configuration extended by discovered devices, configured ones take precedence."""
+    cube = dict(cube)
+    for conf_key, discovered in inventory.items():
+        configured = list(cube.get(conf_key, []))
+        known = {device[CONF_HEX_ADDRESS].lower() for device in configured}
+        configured.extend(
+            device for device in discovered
+            if device[CONF_HEX_ADDRESS].lower() not in known)
+        cube[conf_key] = configured
+    return cube
+
+class MaxHomeAutomationDiscovery:
+    """Discover devices of cubes once, keep the inventory in Home Assistant storage."""
+
+    def __init__(self, hass):
+        """Initialize the Discovery."""
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        # gateway base URL -> lowercase cube address -> inventory
+        self._cache = None
+        self._changed = False
+
+    async def async_load(self):
+        """Load inventory discovered on previous starts."""
+        self._cache = await self._store.async_load() or {}
+
+    async def async_discover_cube(self, gateway, cube):
+        """Return cube configuration extended by its devices, from the cache or the gateway."""
+        cube_hex_address = cube[CONF_HEX_ADDRESS]
+        gateway_cache = self._cache.setdefault(gateway.base_url, {})
+        inventory = gateway_cache.get(cube_hex_address.lower(), None)
+        if inventory is None:
+            try:
+                response = await gateway.async_get(
+                    "get-status-json?cube={}".format(cube_hex_address), single_flight=True, raw=True)
+                inventory = parse_cube_devices(json_loads(response))
+            except Exception as ex:
+                # do not cache anything, next start tries again
+                _LOGGER.warning("Max! Home Automation discovery failed - Cube: {}, {}".format(cube_hex_address, ex))
+                return cube
+            _LOGGER.info("Discovered %d device(s) on cube %s",
+                sum(len(devices) for devices in inventory.values()), cube_hex_address)
+            gateway_cache[cube_hex_address.lower()] = inventory
+            self._changed = True
+        return merge_cube_devices(cube, inventory)
+
+    async def async_save(self):
+        """Store newly discovered inventory."""
+        if self._changed:
+            await self._store.async_save(self._cache)
+            self._changed = False
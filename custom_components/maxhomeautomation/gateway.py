@@ -0,0 +1,313 @@
+"""HTTP connection to MAX! Home Automation gateway."""
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+
+from homeassistant.exceptions import HomeAssistantError
+
+from .metrics import (
+    MaxHomeAutomationMetrics, METRIC_REQUESTS, METRIC_ERRORS, METRIC_TIMEOUTS,
+    METRIC_SHORT_CIRCUITED, METRIC_BYTES, METRIC_DEDUPLICATED
+    )
+
+_LOGGER = logging.getLogger(__name__)
+
+# DEFAULTS
+DEFAULT_MAX_REQUESTS = 4
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 10
+# seconds of waiting for responses per refresh cycle, 0 for no limit - opt-in, off by default
+DEFAULT_LATENCY_BUDGET = 0
+DEFAULT_BUDGET_WINDOW = 60
+# gateway sends plain ASCII JSON and duty
+RESPONSE_ENCODING = 'utf-8'
+
+# circuit breaker
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_BACKOFF_BASE = 2
+# a returning gateway is picked up within this time, plus jitter
+BREAKER_BACKOFF_MAX = 10
+BREAKER_JITTER = 0.2
+BREAKER_PROBE_WAIT = 1
+
+BREAKER_STATE_CLOSED = 'closed'
+BREAKER_STATE_OPEN = 'open'
+BREAKER_STATE_HALF_OPEN = 'half_open'
+
+class MaxHomeAutomationGatewayUnavailable(HomeAssistantError):
+    """Request short-circuited, the gateway circuit breaker is open."""
+
+class MaxHomeAutomationCircuitBreaker:
+    """Stop calling a failing gateway, probe it with jittered exponential backoff."""
+
+    def __init__(self, name):
+        """Initialize the Circuit Breaker."""
+        self._name = name
+        self._state = BREAKER_STATE_CLOSED
+        # consecutive failures while closed
+        self._failures = 0
+        # consecutive openings without success, drives the backoff
+        self._openings = 0
+        self._retry_at = 0
+        # when the last failure was counted
+        self._failed_at = 0
+        # resolved by the result of the half-open probe, others wait for it
+        self._probe = None
+
+    @property
+    def state(self):
+        """Return breaker state."""
+        return self._state
+
+    def allow_request(self):
+        """Return True if the request may go out, the first one after backoff is the probe."""
+        if self._state == BREAKER_STATE_CLOSED:
+            return True
+        if self._state == BREAKER_STATE_OPEN and time.monotonic() >= self._retry_at:
+            _LOGGER.debug("Probing gateway %s", self._name)
+            self._state = BREAKER_STATE_HALF_OPEN
+            self._probe = asyncio.get_running_loop().create_future()
+            return True
+        return False
+
+    async def async_wait_for_probe(self, timeout):
+        """Wait for result of the probe in flight, at most timeout seconds."""
+        if self._probe is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._probe), timeout)
+        except asyncio.TimeoutError:
+            # ie. probe cancelled - allow_request decides
+            pass
+
+    def _probe_done(self):
+        """Wake up requests waiting for the probe."""
+        if self._probe is not None:
+            if not self._probe.done():
+                self._probe.set_result(None)
+            self._probe = None
+
+    def record_success(self):
+        """Close the breaker, the gateway answers."""
+        if self._state != BREAKER_STATE_CLOSED:
+            _LOGGER.info("Max! Home Automation gateway %s is back", self._name)
+        self._state = BREAKER_STATE_CLOSED
+        self._failures = 0
+        self._openings = 0
+        self._probe_done()
+
+    def record_failure(self, started = None):
+        """Count the failure of request sent at started, open the breaker after too many of them
+        or a failed probe."""
+        # requests which were already in flight when it opened
+        if self._state == BREAKER_STATE_OPEN:
+            return
+        # requests in flight together, ie. status and duty of one refresh, fail as one
+        if started is not None and started < self._failed_at:
+            return
+        self._failed_at = time.monotonic()
+        self._failures += 1
+        if self._state == BREAKER_STATE_HALF_OPEN or self._failures >= BREAKER_FAILURE_THRESHOLD:
+            self._openings += 1
+            backoff = min(BREAKER_BACKOFF_MAX, BREAKER_BACKOFF_BASE * 2 ** (self._openings - 1))
+            backoff *= random.uniform(1 - BREAKER_JITTER, 1 + BREAKER_JITTER)
+            self._retry_at = time.monotonic() + backoff
+            self._state = BREAKER_STATE_OPEN
+            self._failures = 0
+            _LOGGER.warning("Max! Home Automation gateway %s unavailable, next try in %.1f s",
+                self._name, backoff)
+            self._probe_done()
+
+    def retry_in(self):
+        """Return seconds until requests may go out again, None if they may go out now."""
+        if self._state == BREAKER_STATE_CLOSED:
+            return None
+        if self._state == BREAKER_STATE_HALF_OPEN:
+            # wait for result of the probe
+            return BREAKER_PROBE_WAIT
+        return max(0, self._retry_at - time.monotonic())
+
+class MaxHomeAutomationLatencyBudget:
+    """Limit time spent waiting for the gateway per window, ie. one refresh cycle."""
+
+    def __init__(self, budget, window):
+        """Initialize the Latency Budget."""
+        self._budget = budget
+        self._window = window
+        self._window_start = time.monotonic()
+        self._spent = 0
+
+    def _roll(self):
+        """Start a new window once the current one is over."""
+        now = time.monotonic()
+        if now - self._window_start >= self._window:
+            self._window_start = now
+            self._spent = 0
+
+    def spend(self, seconds):
+        """Count time spent waiting for one request."""
+        self._roll()
+        self._spent += seconds
+
+    @property
+    def spent(self):
+        """Return seconds spent in the current window."""
+        self._roll()
+        return self._spent
+
+    def retry_in(self):
+        """Return seconds until the next window if the budget is spent, None otherwise."""
+        if not self._budget:
+            return None
+        self._roll()
+        if self._spent < self._budget:
+            return None
+        return max(0, self._window_start + self._window - time.monotonic())
+
+class MaxHomeAutomationGateway:
+    """Long-lived keep-alive HTTP session shared by all requests to one gateway."""
+
+    def __init__(self, gateway_base_url, max_requests = DEFAULT_MAX_REQUESTS,
+            connect_timeout = DEFAULT_CONNECT_TIMEOUT, read_timeout = DEFAULT_READ_TIMEOUT,
+            latency_budget = DEFAULT_LATENCY_BUDGET, budget_window = DEFAULT_BUDGET_WINDOW):
+        """Initialize the Gateway."""
+        # store initial values
+        self._gateway_base_url = gateway_base_url
+        self._max_requests = max_requests
+        # hung gateway fails fast on connect, slow answer gets the read timeout
+        self._timeout = aiohttp.ClientTimeout(
+            total=connect_timeout + read_timeout, sock_connect=connect_timeout, sock_read=read_timeout)
+        # refreshes beyond the budget wait for the next cycle
+        self.budget = MaxHomeAutomationLatencyBudget(latency_budget, budget_window)
+        # requests beyond the limit wait here, outside of the request timeout
+        self._semaphore = asyncio.Semaphore(max_requests)
+        self._in_flight = 0
+        self._waiting = 0
+        # path -> future of the read request in flight, shared by identical requests
+        self._shared_requests = {}
+        # created on first request, it has to be bound to the running event loop
+        self._session = None
+        # shared by all handlers of the gateway
+        self.breaker = MaxHomeAutomationCircuitBreaker(gateway_base_url)
+        self.metrics = MaxHomeAutomationMetrics()
+
+    @property
+    def base_url(self):
+        """Return gateway base URL."""
+        return self._gateway_base_url
+
+    def retry_in(self):
+        """Return seconds until the gateway may be called again, None if it may be called now."""
+        return self.breaker.retry_in()
+
+    def _get_session(self):
+        """Return the session, create it on first use."""
+        if self._session is None or self._session.closed:
+            # one session per gateway, a connection for each allowed request
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._max_requests),
+                timeout=self._timeout)
+        return self._session
+
+    async def async_get(self, path, single_flight = False, raw = False):
+        """Call the gateway API and return response body, bytes if raw, raise on failure.
+        Single-flight requests for the same path share one request in flight, only for reads."""
+        if not single_flight:
+            body = await self._async_limited_get(path)
+        else:
+            body = await self._async_shared_get(path)
+        if raw:
+            return body
+        return body.decode(RESPONSE_ENCODING, errors='replace')
+
+    async def _async_shared_get(self, path):
+        """Return body of the request in flight for the path, send it if there is none."""
+        future = self._shared_requests.get(path, None)
+        if future is None:
+            future = asyncio.ensure_future(self._async_limited_get(path))
+            self._shared_requests[path] = future
+            future.add_done_callback(self._shared_request_done(path))
+        else:
+            self.metrics.increment(METRIC_DEDUPLICATED)
+        # cancelled caller must not cancel the request of the others
+        return await asyncio.shield(future)
+
+    def _shared_request_done(self, path):
+        """Return callback forgetting the shared request once it is done."""
+
+        def shared_request_done(future):
+            """Forget the request, next one goes to the gateway again."""
+            if self._shared_requests.get(path, None) is future:
+                del self._shared_requests[path]
+            # all callers may have been cancelled - do not log never retrieved exception
+            if not future.cancelled():
+                future.exception()
+
+        return shared_request_done
+
+    async def _async_limited_get(self, path):
+        """Call the gateway API once the request limit allows it."""
+        # probe of the failing gateway in flight - its result decides, do not fail next to it
+        await self.breaker.async_wait_for_probe(self._timeout.total)
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+        try:
+            return await self._async_request(path)
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    async def _async_request(self, path):
+        """Send one request, has to be called with the semaphore acquired."""
+        if not self.breaker.allow_request():
+            self.metrics.increment(METRIC_SHORT_CIRCUITED)
+            raise MaxHomeAutomationGatewayUnavailable(
+                "Gateway {} unavailable".format(self._gateway_base_url))
+        self.metrics.increment(METRIC_REQUESTS)
+        started = time.monotonic()
+        try:
+            async with self._get_session().get(self._gateway_base_url + path) as response:
+                body = await response.read()
+        except asyncio.TimeoutError:
+            self.metrics.increment(METRIC_TIMEOUTS)
+            self.breaker.record_failure(started)
+            raise
+        except aiohttp.ClientError:
+            self.metrics.increment(METRIC_ERRORS)
+            self.breaker.record_failure(started)
+            raise
+        finally:
+            # timeouts spend the budget the most
+            self.budget.spend(time.monotonic() - started)
+        self.metrics.record_latency(time.monotonic() - started)
+        self.metrics.increment(METRIC_BYTES, len(body))
+        # the gateway answers, even if with an error status
+        self.breaker.record_success()
+        if response.status >= 400:
+            self.metrics.increment(METRIC_ERRORS)
+        response.raise_for_status()
+        return body
+
+    def metrics_as_dict(self):
+        """Return request metrics with state of the circuit breaker."""
+        return dict(self.metrics.as_dict(),
+            breaker_state = self.breaker.state,
+            retry_in = self.retry_in(),
+            in_flight = self._in_flight,
+            waiting = self._waiting,
+            budget_spent = self.budget.spent,
+            )
+
+    async def async_close(self):
+        """Close all pooled connections."""
+        if self._session is not None:
+            _LOGGER.debug("Closing connections to %s", self._gateway_base_url)
+            await self._session.close()
+            self._session = None
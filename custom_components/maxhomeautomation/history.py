@@ -0,0 +1,169 @@
+"""Recent history of MAX! device values kept in memory."""
+from array import array
+import logging
+import math
+import time
+
+from homeassistant.core import callback
+
+from .consts import *
+
+_LOGGER = logging.getLogger(__name__)
+
+# DEFAULTS - one day of samples at the default scan interval
+DEFAULT_HISTORY_SIZE = 1440
+
+# device fields kept in the history
+HISTORY_FIELDS = [
+    MHA_API_TEMPERATURE,
+    MHA_API_SET_TEMPERATURE,
+    MHA_API_VALVE,
+    ]
+# cube duty is kept as a series without device
+HISTORY_DUTY = 'duty'
+
+ATTR_MIN = 'min'
+ATTR_MAX = 'max'
+ATTR_MEAN = 'mean'
+ATTR_SAMPLES = 'samples'
+ATTR_VALVE_OPEN_TIME = 'valve_open_time'
+
+NAN = float('nan')
+
+def aggregate(values):
+    """Return min, max, mean and count of values, empty when there are none."""
+    if not values:
+        return {ATTR_SAMPLES: 0}
+    return {
+        ATTR_MIN: min(values),
+        ATTR_MAX: max(values),
+        ATTR_MEAN: sum(values) / len(values),
+        ATTR_SAMPLES: len(values),
+        }
+
+class MaxHomeAutomationCubeHistory:
+    """Ring buffer of samples of one cube - shared timestamps, one fixed size array per device field."""
+
+    def __init__(self, size):
+        """Initialize the Cube History."""
+        self._size = size
+        self._timestamps = array('d', [NAN]) * size
+        # (lowercase device address or None for the cube, field) -> values, NaN if not reported
+        self._series = {}
+        # index of the next sample, number of samples kept
+        self._next = 0
+        self._count = 0
+
+    def add(self, timestamp, devices, duty):
+        """Add values of all devices and the duty reported at timestamp."""
+        index = self._next
+        self._timestamps[index] = timestamp
+        written = set()
+        for key, device in devices.items():
+            for field in HISTORY_FIELDS:
+                value = device.get(field, None)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self._set((key, field), index, value)
+                    written.add((key, field))
+        if duty is not None:
+            self._set((None, HISTORY_DUTY), index, duty)
+            written.add((None, HISTORY_DUTY))
+        # series of devices not reported this time
+        for series_key, series in self._series.items():
+            if series_key not in written:
+                series[index] = NAN
+        self._next = (index + 1) % self._size
+        self._count = min(self._count + 1, self._size)
+
+    def _set(self, series_key, index, value):
+        """Store value of the series, create the series on first value."""
+        series = self._series.get(series_key, None)
+        if series is None:
+            series = self._series[series_key] = array('d', [NAN]) * self._size
+        series[index] = value
+
+    def _window(self, since):
+        """Return indexes of samples taken at or after since, oldest first."""
+        first = (self._next - self._count) % self._size
+        indexes = [(first + offset) % self._size for offset in range(self._count)]
+        return [index for index in indexes if self._timestamps[index] >= since]
+
+    def device_keys(self):
+        """Return addresses of devices with history."""
+        return sorted({key for key, field in self._series if key is not None})
+
+    def aggregates(self, device_key, since, now):
+        """Return aggregates of the device fields (cube duty for None) since the time."""
+        indexes = self._window(since)
+        fields = HISTORY_FIELDS if device_key is not None else [HISTORY_DUTY]
+        result = {}
+        for field in fields:
+            series = self._series.get((device_key, field), None)
+            if series is None:
+                continue
+            result[field] = aggregate(
+                [series[index] for index in indexes if not math.isnan(series[index])])
+        valve = self._series.get((device_key, MHA_API_VALVE), None)
+        if device_key is not None and valve is not None:
+            # valve position holds until the next sample, the last one until now
+            open_time = 0
+            for position, index in enumerate(indexes):
+                end = self._timestamps[indexes[position + 1]] if position + 1 < len(indexes) else now
+                if valve[index] > 0:
+                    open_time += end - self._timestamps[index]
+            result[ATTR_VALVE_OPEN_TIME] = open_time
+        return result
+
+class MaxHomeAutomationHistory:
+    """Keep recent history of all cubes, aggregate it on request."""
+
+    def __init__(self):
+        """Initialize the History."""
+        # (gateway base URL, lowercase cube address) -> (cube handler, cube history)
+        self._cubes = {}
+
+    def add_cube(self, gateway_base_url, cube_hex_address, handler, size):
+        """Keep size samples of the cube, nothing if size is 0."""
+        if size > 0:
+            self._cubes[(gateway_base_url, cube_hex_address.lower())] = (
+                handler, MaxHomeAutomationCubeHistory(size))
+
+    def start(self):
+        """Record samples after cube refreshes."""
+        for handler, history in self._cubes.values():
+            handler.async_add_listener(self._async_cube_listener(handler, history))
+
+    def _async_cube_listener(self, handler, history):
+        """Return listener recording fresh data of one cube."""
+        last_updated = [None]
+
+        @callback
+        def async_cube_refreshed():
+            """Record the data once per successful refresh."""
+            if handler.devices is None or handler.stale or handler.updated == last_updated[0]:
+                return
+            last_updated[0] = handler.updated
+            history.add(handler.updated, handler.devices, handler.duty)
+
+        return async_cube_refreshed
+
+    def aggregates(self, window, cube_hex_address = None, device_hex_address = None):
+        """Return aggregates over the last window seconds per gateway, cube and device."""
+        now = time.time()
+        since = now - window
+        result = {}
+        for (gateway_base_url, cube_key), (handler, history) in self._cubes.items():
+            if cube_hex_address is not None and cube_key != cube_hex_address.lower():
+                continue
+            if device_hex_address is not None:
+                device_keys = [device_hex_address.lower()]
+            else:
+                device_keys = history.device_keys()
+            cube_result = {
+                device_key: history.aggregates(device_key, since, now)
+                for device_key in device_keys}
+            if device_hex_address is None:
+                cube_result[HISTORY_DUTY] = history.aggregates(None, since, now).get(
+                    HISTORY_DUTY, aggregate([]))
+            result.setdefault(gateway_base_url, {})[cube_key] = cube_result
+        return result
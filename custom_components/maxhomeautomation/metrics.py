@@ -0,0 +1,71 @@
+"""Performance metrics of MAX! Home Automation gateways and cubes."""
+import time
+
+# upper bounds of latency histogram buckets in seconds, one more bucket takes the rest
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# gateway counters
+METRIC_REQUESTS = 'requests'
+METRIC_ERRORS = 'errors'
+METRIC_TIMEOUTS = 'timeouts'
+METRIC_SHORT_CIRCUITED = 'short_circuited'
+METRIC_BYTES = 'bytes_received'
+METRIC_DEDUPLICATED = 'deduplicated'
+METRIC_FEED_CHANGES = 'feed_changes'
+METRIC_FEED_ERRORS = 'feed_errors'
+# cube counters
+METRIC_REFRESHES = 'refreshes'
+METRIC_REFRESH_FAILURES = 'refresh_failures'
+METRIC_SKIPPED_UPDATES = 'skipped_updates'
+METRIC_DEFERRED_REFRESHES = 'deferred_refreshes'
+METRIC_COMMANDS = 'commands'
+METRIC_COMMAND_FAILURES = 'command_failures'
+METRIC_COMMANDS_COALESCED = 'commands_coalesced'
+METRIC_COMMANDS_DEFERRED = 'commands_deferred'
+
+class MaxHomeAutomationMetrics:
+    """Counters and latency histogram of one gateway or cube."""
+
+    def __init__(self):
+        """Initialize the Metrics."""
+        self._started = time.time()
+        self._counters = {}
+        self._latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._latency_count = 0
+        self._latency_sum = 0
+
+    def increment(self, name, value = 1):
+        """Add value to the counter."""
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def get(self, name):
+        """Return value of the counter."""
+        return self._counters.get(name, 0)
+
+    def record_latency(self, seconds):
+        """Put duration of one request or refresh into the histogram."""
+        index = 0
+        while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+            index += 1
+        self._latency_buckets[index] += 1
+        self._latency_count += 1
+        self._latency_sum += seconds
+
+    @property
+    def latency_mean(self):
+        """Return mean latency in seconds, None before first record."""
+        if not self._latency_count:
+            return None
+        return self._latency_sum / self._latency_count
+
+    def as_dict(self):
+        """Return all metrics as JSON serializable dictionary."""
+        histogram = {
+            "le_{}".format(bound): count
+            for bound, count in zip(LATENCY_BUCKETS, self._latency_buckets)}
+        histogram['le_inf'] = self._latency_buckets[-1]
+        return dict(self._counters,
+            since = self._started,
+            latency_mean = self.latency_mean,
+            latency_histogram = histogram,
+            )
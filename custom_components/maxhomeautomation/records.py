@@ -0,0 +1,93 @@
+"""Compact records of MAX! device data decoded from gateway responses."""
+import json
+import sys
+
+from .consts import *
+
+try:
+    # optional faster decoder, parses bytes without decoding them to str first
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_loads(raw):
+    """Decode JSON from response bytes, by orjson when installed."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+# fields kept from the device JSON, entities read nothing else
+DEVICE_FIELDS = (
+    MHA_API_ADDRESS,
+    MHA_API_NAME,
+    MHA_API_TYPE,
+    MHA_API_TEMPERATURE,
+    MHA_API_SET_TEMPERATURE,
+    MHA_API_MODE,
+    MHA_API_VALVE,
+    MHA_API_OFFSET,
+    MHA_API_ERROR,
+    MHA_API_INITIALIZED,
+    MHA_API_BATTERY,
+    MHA_API_PANEL_LOCKED,
+    MHA_API_LINK_ERROR,
+    MHA_API_OPEN,
+    )
+
+# few distinct values repeated by every device - share one string object
+INTERNED_FIELDS = (MHA_API_TYPE, MHA_API_MODE)
+
+class MaxHomeAutomationDeviceRecord:
+    """Data of one device, read like the JSON dictionary it comes from."""
+
+    __slots__ = DEVICE_FIELDS
+
+    def __init__(self, values):
+        """Initialize the Device Record from decoded JSON, unknown fields are dropped."""
+        for field in DEVICE_FIELDS:
+            value = values.get(field, None)
+            if field in INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        """Records are shared with entities and snapshot - change them by replace()."""
+        raise AttributeError("Device record is read-only")
+
+    def get(self, field, default = None):
+        """Return value of the field, default if the device did not report it."""
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def replace(self, values):
+        """Return copy of the record with values changed."""
+        return MaxHomeAutomationDeviceRecord(dict(self.as_dict(), **values))
+
+    def as_dict(self):
+        """Return reported fields as dictionary, ie. for storage."""
+        return {
+            field: getattr(self, field)
+            for field in DEVICE_FIELDS
+            if getattr(self, field) is not None
+            }
+
+    def __eq__(self, other):
+        """Return True if all fields are equal."""
+        if not isinstance(other, MaxHomeAutomationDeviceRecord):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in DEVICE_FIELDS)
+
+    __hash__ = None
+
+    def __repr__(self):
+        """Return fields for debug log."""
+        return "MaxHomeAutomationDeviceRecord({})".format(self.as_dict())
+
+def parse_devices(raw):
+    """Return records of devices in cube status JSON bytes, indexed by lowercase address."""
+    json_data = json_loads(raw)
+    return {
+        device[MHA_API_ADDRESS].lower(): MaxHomeAutomationDeviceRecord(device)
+        for device in json_data.get(MHA_API_DEVICES, [])
+        if MHA_API_ADDRESS in device
+        }
@@ -0,0 +1,124 @@
+"""Scheduling of MAX! Home Automation polls and commands."""
+import logging
+import random
+
+from .consts import *
+
+_LOGGER = logging.getLogger(__name__)
+
+# DEFAULTS
+DEFAULT_DUTY_SOFT_LIMIT = 50
+DEFAULT_DUTY_HARD_LIMIT = 80
+DEFAULT_POLL_JITTER = 0.1
+# cube drops everything at full duty
+DUTY_FULL = 100
+# poll interval multiplier at the hard limit
+DUTY_MAX_STRETCH = 6
+
+# command priorities, lower is more urgent - hvac mode changes are urgent, temperature changes low
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+def stagger_offset(index, count, interval):
+    """Return offset of index-th of count refreshes spread evenly over the interval."""
+    if count <= 0:
+        return 0
+    return interval * index / count
+
+def jittered(interval, jitter):
+    """Return interval randomly changed by up to jitter fraction of it."""
+    if not jitter:
+        return interval
+    return interval * random.uniform(1 - jitter, 1 + jitter)
+
+class MaxHomeAutomationDutyScheduler:
+    """Spread cube radio duty - stretch polls and defer commands as duty grows."""
+
+    def __init__(self, soft_limit = DEFAULT_DUTY_SOFT_LIMIT, hard_limit = DEFAULT_DUTY_HARD_LIMIT):
+        """Initialize the Duty Scheduler."""
+        self._soft_limit = soft_limit
+        self._hard_limit = max(hard_limit, soft_limit)
+
+    def poll_interval(self, scan_interval, duty):
+        """Return scan interval stretched up to DUTY_MAX_STRETCH times between soft and hard limit."""
+        if duty is None or duty <= self._soft_limit:
+            return scan_interval
+        if duty >= self._hard_limit:
+            return scan_interval * DUTY_MAX_STRETCH
+        ratio = (duty - self._soft_limit) / (self._hard_limit - self._soft_limit)
+        return scan_interval * (1 + ratio * (DUTY_MAX_STRETCH - 1))
+
+    def command_allowed(self, priority, duty):
+        """Return True if command of given priority may be sent at given duty."""
+        if duty is None or duty < self._soft_limit:
+            return True
+        if duty < self._hard_limit:
+            return priority <= PRIORITY_NORMAL
+        if duty < DUTY_FULL:
+            return priority <= PRIORITY_URGENT
+        return False
+
+# adaptive polling - right after a change poll at this fraction of the device interval
+ADAPTIVE_FAST_FACTOR = 0.25
+# stable values stretch the device interval up to this multiple
+ADAPTIVE_SLOW_FACTOR = 4
+# growth of the interval per refresh without change
+ADAPTIVE_GROWTH = 1.5
+ADAPTIVE_MIN_INTERVAL = 5
+# changes which speed polling up - temperature and valve drift all the time, they would keep it fast
+ADAPTIVE_FIELDS = [
+    MHA_API_MODE,
+    MHA_API_SET_TEMPERATURE,
+    MHA_API_OPEN,
+    ]
+
+def fast_interval(interval):
+    """Return interval of polls right after a change, never slower than the configured one."""
+    return min(interval, max(ADAPTIVE_MIN_INTERVAL, interval * ADAPTIVE_FAST_FACTOR))
+
+class MaxHomeAutomationAdaptivePoller:
+    """Track poll interval of each device of a cube - the cube is refreshed for the most demanding one."""
+
+    def __init__(self, default_interval, adaptive = False):
+        """Initialize the Adaptive Poller."""
+        self._default_interval = default_interval
+        self._adaptive = adaptive
+        # lowercase device address -> configured interval
+        self._intervals = {}
+        # lowercase device address -> interval in use
+        self._current = {}
+
+    def add_device(self, device_hex_address, interval = None):
+        """Register device with its own interval, default one if None."""
+        key = device_hex_address.lower()
+        self._intervals[key] = interval or self._default_interval
+        self._current[key] = self._intervals[key]
+
+    def interval(self):
+        """Return interval of the next cube refresh."""
+        if not self._current:
+            return self._default_interval
+        return min(self._current.values())
+
+    def refreshed(self, changed):
+        """Adapt intervals after a refresh - faster for changed devices, slower for stable ones."""
+        if not self._adaptive:
+            return
+        for key, interval in self._intervals.items():
+            if key in changed:
+                self._current[key] = fast_interval(interval)
+            else:
+                self._current[key] = min(interval * ADAPTIVE_SLOW_FACTOR,
+                    self._current[key] * ADAPTIVE_GROWTH)
+
+    def boost(self, device_hex_address):
+        """Poll the device fast after a command, return True if the interval went down."""
+        key = device_hex_address.lower()
+        if not self._adaptive or key not in self._intervals:
+            return False
+        fast = fast_interval(self._intervals[key])
+        if fast >= self._current[key]:
+            return False
+        self._current[key] = fast
+        return True
@@ -1,13 +1,37 @@
 """Support for MAX! Home Automation Thermostats Sensors."""
 import logging
-from homeassistant.helpers.entity import Entity
+from datetime import timedelta
+from homeassistant.core import callback
+from homeassistant.helpers.entity import Entity, EntityCategory
 from homeassistant.const import TEMP_CELSIUS
 from .consts import *
-from .__init__ import MaxHomeAutomationDeviceHandler
-from .__init__ import MaxHomeAutomationCubeHandler
+from .metrics import (
+    METRIC_REQUESTS, METRIC_ERRORS, METRIC_TIMEOUTS,
+    METRIC_SHORT_CIRCUITED, METRIC_BYTES, METRIC_DEDUPLICATED,
+    METRIC_FEED_CHANGES, METRIC_FEED_ERRORS, METRIC_REFRESHES,
+    METRIC_REFRESH_FAILURES, METRIC_SKIPPED_UPDATES, METRIC_DEFERRED_REFRESHES,
+    METRIC_COMMANDS, METRIC_COMMAND_FAILURES, METRIC_COMMANDS_COALESCED,
+    METRIC_COMMANDS_DEFERRED
+    )
 
 _LOGGER = logging.getLogger(__name__)
 
+# only metrics sensors are polled - they change on every poll, do not flood the recorder
+SCAN_INTERVAL = timedelta(minutes=5)
+
+# metrics change all the time, the recorder keeps only the mean latency
+MHA_METRICS_UNRECORDED_ATTRIBUTES = frozenset([
+    METRIC_REQUESTS, METRIC_ERRORS, METRIC_TIMEOUTS,
+    METRIC_SHORT_CIRCUITED, METRIC_BYTES, METRIC_DEDUPLICATED,
+    METRIC_FEED_CHANGES, METRIC_FEED_ERRORS, METRIC_REFRESHES,
+    METRIC_REFRESH_FAILURES, METRIC_SKIPPED_UPDATES, METRIC_DEFERRED_REFRESHES,
+    METRIC_COMMANDS, METRIC_COMMAND_FAILURES, METRIC_COMMANDS_COALESCED,
+    METRIC_COMMANDS_DEFERRED,
+    'since', 'latency_mean', 'latency_histogram',
+    'breaker_state', 'retry_in', 'in_flight', 'waiting', 'budget_spent',
+    'duty', 'poll_interval', 'pending_commands', 'stale', 'updated',
+    ])
+
 # allowed sensors types
 MHA_ALLOWED_SENSOR_TYPES = [
     MHA_SENSOR_TYPE_TEMPERATURE,
@@ -25,6 +49,7 @@ MHA_UNIT_HA_CAST = {
     MHA_SENSOR_TYPE_OFFSET: TEMP_CELSIUS,
     MHA_SENSOR_TYPE_ECO_BUTTON: '',
     MHA_SENSOR_TYPE_DUTY: '%',
+    MHA_SENSOR_TYPE_LATENCY: 'ms',
 }
 
 # map sensor type to icon
@@ -35,91 +60,32 @@ MHA_ICON_HA_CAST = {
     MHA_SENSOR_TYPE_OFFSET: 'mdi:delta',
     MHA_SENSOR_TYPE_ECO_BUTTON: 'mdi:home-automation',
     MHA_SENSOR_TYPE_DUTY: 'mdi:radio-tower',
+    MHA_SENSOR_TYPE_LATENCY: 'mdi:timer-outline',
 }
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
-    """Iterate through all MAX! Devices."""
-
-    devices = []
-
-    # read configuration and setup platform
-    gateways = hass.data[DATA_KEY][DOMAIN][CONF_GATEWAYS]
-    for gateway in gateways:
-        host = gateway[CONF_HOST]
-        port = gateway[CONF_PORT]
-        scan_interval = gateway[CONF_SCAN_INTERVAL].total_seconds()
-        cubes = gateway[CONF_CUBES]
-        gateway_url_base= "http://{}:{}/".format(host, port)
-
-        # walk trough cubes
-        for cube in cubes:
-            # read config
-            cube_address = cube[CONF_HEX_ADDRESS]
-            cube_name = cube[CONF_NAME]
-            radiator_thermostats = cube[CONF_RADIATOR_THERMOSTATS]
-            wall_thermostats = cube[CONF_WALL_THERMOSTATS]
-            window_shutters = cube[CONF_WINDOWS_SHUTTERS]
-            eco_buttons = cube[CONF_ECO_BUTTONS]
-
-            # walk trough radiator thermostats
-            for radiator_thermostat in radiator_thermostats:
-                device_address = radiator_thermostat[CONF_HEX_ADDRESS]
-                device_name = radiator_thermostat[CONF_NAME]
-
-                handler = MaxHomeAutomationDeviceHandler(
-                    gateway_url_base, cube_address, device_address, scan_interval)
-
-                devices.append(
-                    MaxHomeAutomationSensor (handler, device_name + " - Temperature", MHA_SENSOR_TYPE_TEMPERATURE))
-                devices.append(
-                    MaxHomeAutomationSensor (handler, device_name + " - Target Temperature", MHA_SENSOR_TYPE_SET_TEMPERATURE))
-                devices.append(
-                    MaxHomeAutomationSensor (handler, device_name + " - Valve", MHA_SENSOR_TYPE_VALVE))
-                devices.append(
-                    MaxHomeAutomationSensor (handler, device_name + " - Offset", MHA_SENSOR_TYPE_OFFSET))
-
-
-            # walk trough wall thermostats
-            for wall_thermostat in wall_thermostats:
-                device_address = wall_thermostat[CONF_HEX_ADDRESS]
-                device_name = wall_thermostat[CONF_NAME]
-
-                handler = MaxHomeAutomationDeviceHandler(
-                    gateway_url_base, cube_address, device_address, scan_interval)
-
-                devices.append(
-                    MaxHomeAutomationSensor (handler, device_name + " - Temperature", MHA_SENSOR_TYPE_TEMPERATURE))
-                devices.append(
-                    MaxHomeAutomationSensor (handler, device_name + " - Target Temperature", MHA_SENSOR_TYPE_SET_TEMPERATURE))
-                devices.append(
-                    MaxHomeAutomationSensor (handler, device_name + " - Offset", MHA_SENSOR_TYPE_OFFSET))
-
-
-            # walk trough eco buttons
-            for eco_button in eco_buttons:
-                device_address = eco_button[CONF_HEX_ADDRESS]
-                device_name = eco_button[CONF_NAME]
-
-                handler = MaxHomeAutomationDeviceHandler(
-                    gateway_url_base, cube_address, device_address, scan_interval)
-
-                devices.append(
-                    MaxHomeAutomationSensor (handler, device_name + " - Mode", MHA_SENSOR_TYPE_ECO_BUTTON))
-
-
-            # duty sensor
-            handler = MaxHomeAutomationCubeHandler(
-                    gateway_url_base, cube_address, scan_interval)
-            devices.append(
-                MaxHomeAutomationDutySensor (handler, cube_name + " - Duty"))
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """Add sensors described at integration setup."""
 
+    devices = [
+        create_sensor (handler, name, sensor_type)
+        for handler, name, sensor_type in hass.data[DATA_KEY][DATA_ENTITIES][PLATFORM_SENSOR]
+        ]
 
     if devices:
-        add_entities(devices)
+        # no update before add - cube handlers refresh in background
+        async_add_entities(devices)
 
     # platform initialization was successful
     return True
 
+def create_sensor(handler, name, sensor_type):
+    """Return sensor of the type - cube duty, metrics or device one."""
+    if sensor_type == MHA_SENSOR_TYPE_DUTY:
+        return MaxHomeAutomationDutySensor(handler, name)
+    if sensor_type == MHA_SENSOR_TYPE_LATENCY:
+        return MaxHomeAutomationMetricsSensor(handler, name)
+    return MaxHomeAutomationSensor(handler, name, sensor_type)
+
 class MaxHomeAutomationSensor(Entity):
     """Representation of a Max! Home Automation sensor."""
 
@@ -133,13 +99,11 @@ class MaxHomeAutomationSensor(Entity):
         self._name = name
         self._sensor_type = sensor_type
         self._state = None
-        # read current value
-        self.update()
 
     @property
     def should_poll(self):
-        """Return the polling state."""
-        return True
+        """Return the polling state - cube handler pushes new data."""
+        return False
 
     @property
     def state(self):
@@ -155,6 +119,13 @@ class MaxHomeAutomationSensor(Entity):
     def sensor_type (self):
         return self._sensor_type;
 
+    @property
+    def extra_state_attributes(self):
+        """Return stale flag while data are from before restart."""
+        if self._device_handler.stale:
+            return {ATTR_STALE: True}
+        return None
+
     @property
     def unit_of_measurement(self):
         """Return the unit of measurement of this entity, if any."""
@@ -165,9 +136,26 @@ class MaxHomeAutomationSensor(Entity):
         """Return the icon to use in the frontend, if any."""
         return MHA_ICON_HA_CAST.get(self.sensor_type, None)
 
-    def update(self):
+    async def async_added_to_hass(self):
+        """Subscribe to cube handler refreshes."""
+        # data may be already there from the initial refresh
+        self._update_state()
+        self.async_on_remove(
+            self._device_handler.async_add_listener(self._async_handle_update, [self.sensor_type]))
+
+    @callback
+    def _async_handle_update(self):
+        """Take over new data pushed by the cube handler."""
+        self._update_state()
+        self.async_write_ha_state()
+
+    async def async_update(self):
         """Get latest data from MAX! Home Automation"""
-        self._device_handler.update()
+        await self._device_handler.async_update()
+        self._update_state()
+
+    def _update_state(self):
+        """Read the state from data of the device handler."""
         # find the device
         device = self._device_handler.data
         # device not found
@@ -193,13 +181,12 @@ class MaxHomeAutomationDutySensor(Entity):
         self._cubehandle = cubehandle
         self._name = name
         self._state = None
-        # read current value
-        self.update()
+        self._stale = False
 
     @property
     def should_poll(self):
-        """Return the polling state."""
-        return True
+        """Return the polling state - cube handler pushes new data."""
+        return False
 
     @property
     def state(self):
@@ -215,6 +202,13 @@ class MaxHomeAutomationDutySensor(Entity):
     def sensor_type (self):
         return MHA_SENSOR_TYPE_DUTY;
 
+    @property
+    def extra_state_attributes(self):
+        """Return stale flag while data are from before restart."""
+        if self._cubehandle.stale:
+            return {ATTR_STALE: True}
+        return None
+
     @property
     def unit_of_measurement(self):
         """Return the unit of measurement of this entity, if any."""
@@ -225,9 +219,30 @@ class MaxHomeAutomationDutySensor(Entity):
         """Return the icon to use in the frontend, if any."""
         return MHA_ICON_HA_CAST.get(self.sensor_type, None)
 
-    def update(self):
+    async def async_added_to_hass(self):
+        """Subscribe to cube handler refreshes."""
+        # data may be already there from the initial refresh
+        self._update_state()
+        self.async_on_remove(
+            self._cubehandle.async_add_listener(self._async_handle_update))
+
+    @callback
+    def _async_handle_update(self):
+        """Take over new data pushed by the cube handler, write only changed duty."""
+        state = self._state
+        stale = self._stale
+        self._update_state()
+        if state != self._state or stale != self._stale:
+            self.async_write_ha_state()
+
+    async def async_update(self):
         """Get latest data from MAX! Home Automation"""
-        self._cubehandle.update()
+        await self._cubehandle.async_update()
+        self._update_state()
+
+    def _update_state(self):
+        """Read the state from data of the cube handler."""
+        self._stale = self._cubehandle.stale
         value = self._cubehandle.cube_duty
         # no value
         if value is None:
@@ -237,3 +252,52 @@ class MaxHomeAutomationDutySensor(Entity):
         value = value.replace('%', '')
         # update internal values
         self._state = value
+
+class MaxHomeAutomationMetricsSensor(Entity):
+    """Representation of a Max! Home Automation gateway or cube metrics sensor."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _unrecorded_attributes = MHA_METRICS_UNRECORDED_ATTRIBUTES
+
+    def __init__(self, source, name):
+        """Initialize the sensor."""
+        # store values - gateway or cube handler
+        self._source = source
+        self._name = name
+
+    @property
+    def should_poll(self):
+        """Return the polling state - metrics are only kept in memory."""
+        return True
+
+    @property
+    def state(self):
+        """Return mean latency in milliseconds."""
+        latency = self._source.metrics.latency_mean
+        if latency is None:
+            return None
+        return round(latency * 1000, 1)
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return self._name
+
+    @property
+    def sensor_type (self):
+        return MHA_SENSOR_TYPE_LATENCY;
+
+    @property
+    def extra_state_attributes(self):
+        """Return all counters and the latency histogram."""
+        return self._source.metrics_as_dict()
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of measurement of this entity, if any."""
+        return MHA_UNIT_HA_CAST.get(self.sensor_type, None)
+
+    @property
+    def icon(self):
+        """Return the icon to use in the frontend, if any."""
+        return MHA_ICON_HA_CAST.get(self.sensor_type, None)
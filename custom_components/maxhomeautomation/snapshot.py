@@ -0,0 +1,81 @@
+"""Snapshot of the last MAX! Home Automation data kept over restarts."""
+import logging
+import time
+
+from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+
+from .consts import *
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+STORAGE_KEY = DOMAIN + '.snapshot'
+# write at most once per this many seconds, last changes are written on shutdown
+SNAPSHOT_SAVE_DELAY = 60
+
+SNAPSHOT_DEVICES = 'devices'
+SNAPSHOT_DUTY = 'duty'
+SNAPSHOT_UPDATED = 'updated'
+
+class MaxHomeAutomationSnapshot:
+    """Persist the latest data of all cubes, seed the cube handlers with it on start."""
+
+    def __init__(self, hass, cube_handlers):
+        """Initialize the Snapshot."""
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._cube_handlers = cube_handlers
+        # gateway base URL -> lowercase cube address -> last successfully fetched data
+        self._data = {}
+
+    async def async_load(self):
+        """Seed the cube handlers with data stored before restart."""
+        self._data = await self._store.async_load() or {}
+        for (gateway_base_url, cube_key), handler in self._cube_handlers.items():
+            cube_data = self._data.get(gateway_base_url, {}).get(cube_key, None)
+            if cube_data is None:
+                continue
+            handler.seed(
+                cube_data[SNAPSHOT_DEVICES], cube_data[SNAPSHOT_DUTY], cube_data[SNAPSHOT_UPDATED])
+            _LOGGER.debug("Seeded cube %s with data from %s",
+                cube_key, time.ctime(cube_data[SNAPSHOT_UPDATED]))
+
+    def start(self):
+        """Save the snapshot after cube refreshes."""
+        for (gateway_base_url, cube_key), handler in self._cube_handlers.items():
+            handler.async_add_listener(self._async_cube_listener(gateway_base_url, cube_key, handler))
+
+    def _async_cube_listener(self, gateway_base_url, cube_key, handler):
+        """Return listener taking over data of one cube."""
+
+        @callback
+        def async_cube_refreshed():
+            """Keep the fresh data, failed refresh keeps the previous one."""
+            if handler.devices is None or handler.stale:
+                return
+            cube_data = self._data.setdefault(gateway_base_url, {}).get(cube_key, None)
+            if cube_data is not None and cube_data[SNAPSHOT_UPDATED] == handler.updated:
+                return
+            self._data[gateway_base_url][cube_key] = {
+                SNAPSHOT_DEVICES: handler.devices,
+                SNAPSHOT_DUTY: handler.cube_duty,
+                SNAPSHOT_UPDATED: handler.updated,
+                }
+            # many refreshes end up in one write
+            self._store.async_delay_save(self._data_to_save, SNAPSHOT_SAVE_DELAY)
+
+        return async_cube_refreshed
+
+    @callback
+    def _data_to_save(self):
+        """Return the snapshot of all cubes, device records as dictionaries."""
+        return {
+            gateway_base_url: {
+                cube_key: dict(cube_data, **{SNAPSHOT_DEVICES: {
+                    key: device if isinstance(device, dict) else device.as_dict()
+                    for key, device in cube_data[SNAPSHOT_DEVICES].items()
+                    }})
+                for cube_key, cube_data in cubes.items()
+                }
+            for gateway_base_url, cubes in self._data.items()
+            }
@@ -0,0 +1,194 @@
+"""Change feed of MAX! Home Automation gateway - device changes pushed between polls."""
+import abc
+import asyncio
+import logging
+import random
+
+import aiohttp
+
+from homeassistant.core import callback
+
+from .consts import *
+from .records import MaxHomeAutomationDeviceRecord, json_loads
+from .gateway import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from .metrics import METRIC_FEED_CHANGES, METRIC_FEED_ERRORS
+
+_LOGGER = logging.getLogger(__name__)
+
+# transports, polling only is the default
+TRANSPORT_POLLING = 'polling'
+TRANSPORT_LONG_POLL = 'long_poll'
+TRANSPORT_SSE = 'sse'
+TRANSPORTS = [TRANSPORT_POLLING, TRANSPORT_LONG_POLL, TRANSPORT_SSE]
+
+# DEFAULTS
+DEFAULT_TRANSPORT = TRANSPORT_POLLING
+DEFAULT_FEED_PATH = 'get-changes'
+# seconds the gateway holds a long-poll request, sends at least a keep-alive comment on the stream
+DEFAULT_FEED_HOLD = 55
+FEED_RETRY_MIN = 1
+FEED_RETRY_MAX = 60
+
+# gateway without the feed answers these
+FEED_UNSUPPORTED_STATUS = (404, 405, 501)
+
+# feed message - {"cursor": ..., "changes": [{"cube": address, "device": {device status JSON}}]}
+FEED_CURSOR = 'cursor'
+FEED_CHANGES = 'changes'
+FEED_CUBE = 'cube'
+FEED_DEVICE = 'device'
+
+FEED_STATE_STOPPED = 'stopped'
+FEED_STATE_CONNECTING = 'connecting'
+FEED_STATE_CONNECTED = 'connected'
+FEED_STATE_UNSUPPORTED = 'unsupported'
+
+class MaxHomeAutomationChangeFeed(abc.ABC):
+    """Receive device changes from the gateway and hand them to cube handlers.
+    Polling goes on regardless, the feed only brings changes sooner."""
+
+    def __init__(self, hass, gateway, cube_handlers, path = DEFAULT_FEED_PATH,
+            connect_timeout = DEFAULT_CONNECT_TIMEOUT, read_timeout = DEFAULT_READ_TIMEOUT):
+        """Initialize the Change Feed."""
+        self._hass = hass
+        self._gateway = gateway
+        # lowercase cube address -> cube handler
+        self._cube_handlers = cube_handlers
+        self._url = gateway.base_url + path
+        # held request or idle stream must not end as a read timeout
+        self._timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=connect_timeout, sock_read=DEFAULT_FEED_HOLD + read_timeout)
+        self._session = None
+        self._task = None
+        self.state = FEED_STATE_STOPPED
+
+    @callback
+    def start(self):
+        """Listen in background until stopped."""
+        if self._task is None:
+            # not tracked by Home Assistant, it never finishes on its own
+            self._task = asyncio.get_running_loop().create_task(self._async_run())
+
+    async def async_stop(self):
+        """Stop listening and close the connection."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _async_run(self):
+        """Listen until stopped or the gateway has no feed, state tells it is no longer listening."""
+        try:
+            await self._async_listen_forever()
+        finally:
+            if self.state != FEED_STATE_UNSUPPORTED:
+                self.state = FEED_STATE_STOPPED
+
+    async def _async_listen_forever(self):
+        """Listen, reconnect with backoff on failure, give up if the gateway has no feed."""
+        # own session - held connection does not take a slot of the request limit
+        self._session = aiohttp.ClientSession(timeout=self._timeout)
+        failures = 0
+        while True:
+            # gateway is failing - wait for its circuit breaker as polling does
+            retry_in = self._gateway.retry_in()
+            if retry_in:
+                await asyncio.sleep(retry_in)
+            self.state = FEED_STATE_CONNECTING
+            try:
+                await self._async_listen()
+                failures = 0
+            except aiohttp.ClientResponseError as ex:
+                if ex.status in FEED_UNSUPPORTED_STATUS:
+                    _LOGGER.info("Gateway %s has no change feed at %s, polling only",
+                        self._gateway.base_url, self._url)
+                    self.state = FEED_STATE_UNSUPPORTED
+                    return
+                failures += 1
+                self._gateway.metrics.increment(METRIC_FEED_ERRORS)
+                _LOGGER.debug("Change feed of %s failed: %s", self._gateway.base_url, ex)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as ex:
+                failures += 1
+                self._gateway.metrics.increment(METRIC_FEED_ERRORS)
+                _LOGGER.debug("Change feed of %s failed: %s", self._gateway.base_url, ex)
+            except Exception:
+                # ie. malformed message - the task is not tracked, nobody else would see it
+                failures += 1
+                self._gateway.metrics.increment(METRIC_FEED_ERRORS)
+                _LOGGER.exception("Unexpected error in change feed of %s", self._gateway.base_url)
+            self.state = FEED_STATE_CONNECTING
+            # stream closed by the gateway is reconnected after the shortest delay
+            delay = min(FEED_RETRY_MAX, FEED_RETRY_MIN * 2 ** max(0, failures - 1))
+            await asyncio.sleep(random.uniform(0.5, 1) * delay)
+
+    @abc.abstractmethod
+    async def _async_listen(self):
+        """Receive changes until the connection ends, raise on failure."""
+
+    @callback
+    def _async_handle_message(self, message):
+        """Pass changed devices to their cube handlers."""
+        changes = {}
+        for change in message.get(FEED_CHANGES, None) or []:
+            cube = change.get(FEED_CUBE, None)
+            device = change.get(FEED_DEVICE, None)
+            if not cube or not device or MHA_API_ADDRESS not in device:
+                continue
+            changes.setdefault(cube.lower(), {})[device[MHA_API_ADDRESS].lower()] = (
+                MaxHomeAutomationDeviceRecord(device))
+        for cube_key, devices in changes.items():
+            handler = self._cube_handlers.get(cube_key, None)
+            if handler is not None:
+                self._gateway.metrics.increment(METRIC_FEED_CHANGES, len(devices))
+                handler.async_apply_changes(devices)
+
+class MaxHomeAutomationLongPollFeed(MaxHomeAutomationChangeFeed):
+    """Changes by long-poll - the gateway holds the request until something changes."""
+
+    async def _async_listen(self):
+        """Ask for changes after the cursor again and again."""
+        # first answer only tells where the feed is, older changes came by polling
+        cursor = None
+        while True:
+            params = {'timeout': DEFAULT_FEED_HOLD}
+            if cursor is not None:
+                params['since'] = cursor
+            async with self._session.get(self._url, params=params) as response:
+                response.raise_for_status()
+                message = json_loads(await response.read())
+            self.state = FEED_STATE_CONNECTED
+            if cursor is not None:
+                self._async_handle_message(message)
+            cursor = message.get(FEED_CURSOR, cursor)
+
+class MaxHomeAutomationSseFeed(MaxHomeAutomationChangeFeed):
+    """Changes by server-sent events - one message per event on a stream held open."""
+
+    async def _async_listen(self):
+        """Read events until the gateway closes the stream."""
+        headers = {'Accept': 'text/event-stream'}
+        async with self._session.get(self._url, headers=headers) as response:
+            response.raise_for_status()
+            self.state = FEED_STATE_CONNECTED
+            data = []
+            async for line in response.content:
+                line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+                if line.startswith('data:'):
+                    data.append(line[5:].lstrip(' '))
+                elif not line and data:
+                    # blank line ends the event
+                    self._async_handle_message(json_loads('\n'.join(data)))
+                    data = []
+                # comments (keep-alive), id and event fields are not used
+
+# transport -> change feed, polling has none
+FEED_CLASSES = {
+    TRANSPORT_LONG_POLL: MaxHomeAutomationLongPollFeed,
+    TRANSPORT_SSE: MaxHomeAutomationSseFeed,
+    }
@@ -0,0 +1,94 @@
+"""Zones of MAX! thermostats set by one bulk command."""
+import asyncio
+import logging
+
+from .consts import *
+from .commands import TEMPERATURE_MODES
+from .scheduler import PRIORITY_LOW, PRIORITY_URGENT
+
+_LOGGER = logging.getLogger(__name__)
+
+# per-device results of a bulk command
+RESULT_SENT = 'sent'
+RESULT_FAILED = 'failed'
+RESULT_UNCHANGED = 'unchanged'
+RESULT_UNKNOWN = 'unknown'
+RESULT_SKIPPED = 'skipped'
+
+def plan_command(device, hvac_mode, temperature):
+    """Return mode and temperature to send to the device, None if it already has them.
+    Raise ValueError if the mode is not given and the device did not report its own."""
+    current_mode = None
+    if device is not None:
+        current_mode = MAP_MHA_HVAC_MODE_HASS.get(device.get(MHA_API_MODE, None), None)
+    mode = hvac_mode or current_mode
+    if mode is None:
+        raise ValueError("Unknown hvac mode")
+    if (mode == current_mode and
+            (temperature is None or device.get(MHA_API_SET_TEMPERATURE, None) == temperature)):
+        return None
+    return (mode, temperature)
+
+class MaxHomeAutomationZones:
+    """Thermostats by address and zone, bulk commands for many of them."""
+
+    def __init__(self):
+        """Initialize the Zones."""
+        # lowercase device address -> device handlers of thermostats with that address
+        self._thermostats = {}
+        # zone name -> lowercase device addresses
+        self._zones = {}
+
+    def add_thermostat(self, device_hex_address, device_handler):
+        """Register thermostat which bulk commands may set."""
+        self._thermostats.setdefault(device_hex_address.lower(), []).append(device_handler)
+
+    def add_zone(self, zone_name, device_hex_addresses):
+        """Add devices to the zone, zone may span cubes and gateways."""
+        self._zones.setdefault(zone_name, []).extend(
+            address.lower() for address in device_hex_addresses)
+
+    def devices(self, zone_name = None, device_hex_addresses = None):
+        """Return lowercase addresses of the zone and the devices, in order, without duplicates."""
+        addresses = list(self._zones.get(zone_name, [])) if zone_name is not None else []
+        addresses.extend(address.lower() for address in device_hex_addresses or [])
+        return list(dict.fromkeys(addresses))
+
+    async def async_set(self, addresses, hvac_mode = None, temperature = None):
+        """Send mode and temperature to the thermostats, return result of each device.
+        Devices already set are skipped, commands go through the cube queues concurrently."""
+        # mode changes, ie. off for the whole floor, get through even at high duty
+        priority = PRIORITY_URGENT if hvac_mode is not None else PRIORITY_LOW
+        results = {}
+        pending = {}
+        for address in addresses:
+            handlers = self._thermostats.get(address, None)
+            if not handlers:
+                _LOGGER.warning("Zone command skips unknown thermostat %s", address)
+                results[address] = RESULT_UNKNOWN
+                continue
+            for handler in handlers:
+                try:
+                    command = plan_command(handler.data, hvac_mode, temperature)
+                except ValueError:
+                    _LOGGER.warning("Zone command skips thermostat %s without reported mode", address)
+                    results[address] = RESULT_UNKNOWN
+                    continue
+                if command is None:
+                    results.setdefault(address, RESULT_UNCHANGED)
+                    continue
+                if hvac_mode is None and command[0] not in TEMPERATURE_MODES:
+                    # boost and vacation ignore the temperature, sending them again would restart them
+                    _LOGGER.warning("Zone command skips thermostat %s in mode %s, it does not take temperature",
+                        address, command[0])
+                    results[address] = RESULT_SKIPPED
+                    continue
+                pending.setdefault(address, []).append(handler.async_send_command(*command, priority))
+
+        # queues of all cubes dispatch in parallel, each within its duty budget
+        for address, futures in pending.items():
+            sent = await asyncio.gather(*futures)
+            results[address] = RESULT_SENT if all(sent) else RESULT_FAILED
+        _LOGGER.debug("Zone command results: %s", results)
+        # in the order of the request
+        return {address: results[address] for address in addresses}